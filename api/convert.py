@@ -1,16 +1,30 @@
 # app.py  ── listo para Vercel o ejecución local JHONNY 
+import csv
+import hashlib
+import json
 import logging
 import os
 import re
+import shutil
+import sqlite3
+import sys
 import tempfile
+import time
 import traceback
-from collections import defaultdict
-from io import BytesIO
-from typing import Dict, List
-
-import pdfplumber
-from flask import Flask, request, send_file
-from openpyxl import Workbook
+import uuid
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from importlib.util import find_spec
+from io import BytesIO, StringIO
+from itertools import chain
+from operator import itemgetter
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+# pdfplumber, numpy, openpyxl y el pool de procesos se importan al primer uso:
+# en frío (Vercel) solo se paga lo que el request necesita. Medir con
+# python bench/importtime.py
+from flask import Flask, Response, jsonify, request, send_file, stream_with_context
 
 # ──────────────────────────────  CONFIG GLOBAL  ─────────────────────────────
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
@@ -21,52 +35,495 @@ COLS = [
     "Origin", "Quantity", "Unit Price", "Total Price", "Invoice Number"
 ]
 
+# Procesos para varios PDFs por request (1 = secuencial, p.ej. en Vercel sin /dev/shm)
+WORKERS       = int(os.environ.get("CONVERT_WORKERS", "1"))
+WORKER_MEM_MB = int(os.environ.get("CONVERT_WORKER_MEM_MB", "0"))   # 0 = sin límite
+# Procesos por páginas para un solo PDF grande (solo si no se usa el pool por archivo)
+PAGE_WORKERS         = int(os.environ.get("CONVERT_PAGE_WORKERS", "1"))
+PAGE_SHARD_MIN_PAGES = int(os.environ.get("CONVERT_PAGE_SHARD_MIN_PAGES", "40"))
+# Caché de resultados por sha256 del PDF (en /tmp por defecto; 0 MB = desactivada)
+CACHE_DIR    = os.environ.get("CONVERT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "convert-cache"))
+CACHE_MAX_MB = int(os.environ.get("CONVERT_CACHE_MAX_MB", "256"))
+# Jobs asíncronos (/api/jobs): necesitan un proceso que siga vivo tras responder
+JOBS_DIR     = os.environ.get("CONVERT_JOBS_DIR", os.path.join(tempfile.gettempdir(), "convert-jobs"))
+JOBS_DB      = os.environ.get("CONVERT_JOBS_DB", os.path.join(JOBS_DIR, "jobs.sqlite"))
+JOB_WORKERS  = int(os.environ.get("CONVERT_JOB_WORKERS", "2"))
+JOB_TTL_H    = float(os.environ.get("CONVERT_JOB_TTL_H", "24"))
+# Perfiles opt-in: el header X-Profile (cprofile | pyinstrument) solo se atiende
+# con CONVERT_PROFILE=1; PROFILE_DIR se poda a PROFILE_MAX_MB (más antiguos primero)
+PROFILE      = os.environ.get("CONVERT_PROFILE", "0") == "1"
+PROFILE_DIR  = os.environ.get("CONVERT_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "convert-profiles"))
+PROFILE_MAX_MB = int(os.environ.get("CONVERT_PROFILE_MAX_MB", "64"))
+PROFILE_KINDS  = ("cprofile", "pyinstrument")
+# Pre-filtro de páginas sin ítems (portadas, T&C, packing lists…); 0 = desactivado
+PAGE_SCREEN  = os.environ.get("CONVERT_PAGE_SCREEN", "1") != "0"
+# Modo baja memoria: suelta los objetos de layout de cada página al terminarla
+# (1 | 0 | auto = solo PDFs de LOW_MEMORY_MIN_PAGES páginas o más)
+LOW_MEMORY           = os.environ.get("CONVERT_LOW_MEMORY", "auto").strip().lower()
+LOW_MEMORY_MIN_PAGES = int(os.environ.get("CONVERT_LOW_MEMORY_MIN_PAGES", "100"))
+# Techo de RSS por proceso: se corta con MemoryCeilingExceeded antes del OOM killer (0 = sin techo)
+MAX_RSS_MB           = int(os.environ.get("CONVERT_MAX_RSS_MB", "0"))
+# Extractores activos en este despliegue (ver EXTRACTORS): lista blanca (vacía = todos)
+# y/o lista negra, separadas por coma, p.ej. CONVERT_EXTRACTORS_OFF=lvmh,ipusa
+EXTRACTORS_ON  = {n.strip() for n in os.environ.get("CONVERT_EXTRACTORS", "").split(",") if n.strip()}
+EXTRACTORS_OFF = {n.strip() for n in os.environ.get("CONVERT_EXTRACTORS_OFF", "").split(",") if n.strip()}
+# Barrido de layout desconocido: para cuando un extractor "reclama" el documento
+# (fracción de filas con qty × unit = total); > 1 = correr siempre todos
+SWEEP_CLAIM    = float(os.environ.get("CONVERT_SWEEP_CLAIM", "0.9"))
+# Contadores hit/miss por LinePattern en los stats (cuestan una llamada Python por línea)
+RE_STATS       = os.environ.get("CONVERT_RE_STATS", "0") == "1"
+
+# ───────────────  FILA: registro compacto compartido por los extractores  ───────────────
+class LineItem:
+    """
+    Una línea de artículo. Con __slots__ en vez de un dict por fila (sin dict
+    por instancia ni claves repetidas); los campos siguen el orden de COLS,
+    así as_row() es directamente la fila del Excel. order_nr no sale en el
+    Excel y es None en los layouts que no lo leen. derived marca las filas
+    cuyo total se calculó como qty × unit (la línea no trae total).
+    """
+    __slots__ = ("ref", "ean", "custom", "desc", "origin",
+                 "qty", "unit", "total", "invoice", "order_nr", "derived")
+
+    def __init__(self, ref: str, ean: str, custom: str, desc: str, origin: str,
+                 qty: int, unit: float, total: float, invoice: str,
+                 order_nr: Optional[str] = None, derived: bool = False):
+        self.ref, self.ean, self.custom, self.desc, self.origin = ref, ean, custom, desc, origin
+        self.qty, self.unit, self.total, self.invoice = qty, unit, total, invoice
+        self.order_nr, self.derived = order_nr, derived
+
+    def as_row(self) -> tuple:
+        """Valores en el orden de COLS."""
+        return (self.ref, self.ean, self.custom, self.desc, self.origin,
+                self.qty, self.unit, self.total, self.invoice)
+
+    def as_dict(self) -> dict:
+        d = dict(zip(COLS, self.as_row()))
+        if self.order_nr is not None:
+            d["Your Order Nr"] = self.order_nr
+        return d
+
+    def __repr__(self) -> str:
+        return f"LineItem{self.as_row()!r}"
+
+
+# ───────────────  MÉTRICAS: tiempos por etapa + contadores  ───────────────
+class StageTimer:
+    """
+    Acumula segundos por etapa y contadores (páginas, chars, filas…).
+    Es un dict plano (to_dict/merge) para poder volver de un worker del pool.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def to_dict(self) -> dict:
+        return {"stages": dict(self.stages), "counts": dict(self.counts)}
+
+    def merge(self, other: dict) -> None:
+        for k, v in other.get("stages", {}).items():
+            self.add(k, v)
+        for k, v in other.get("counts", {}).items():
+            self.count(k, v)
+
+    def log_json(self, event: str, **extra) -> None:
+        logging.info(json.dumps({
+            "event": event, **extra,
+            "stages_ms": {k: round(v * 1000, 1) for k, v in self.stages.items()},
+            "counts": self.counts,
+        }, ensure_ascii=False, default=str))
+
+    def server_timing(self) -> str:
+        """Header Server-Timing (ms); las etapas de texto se solapan con las de extracción."""
+        return ", ".join(f"{k};dur={v * 1000:.1f}" for k, v in self.stages.items())
+
+# ───────────────  MEMORIA: techo de RSS  ───────────────
+class MemoryCeilingExceeded(RuntimeError):
+    """El proceso superó MAX_RSS_MB durante la extracción."""
+
+def rss_mb() -> float:
+    """RSS actual del proceso en MB (/proc); fuera de Linux, el pico (getrusage)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+def check_rss(where: str, limit_mb: int = MAX_RSS_MB) -> None:
+    """Corta con un error claro si el RSS pasa de limit_mb (0 = sin techo)."""
+    if limit_mb > 0 and (used := rss_mb()) > limit_mb:
+        raise MemoryCeilingExceeded(
+            f"Memoria agotada en {where}: RSS {used:.0f} MB > límite {limit_mb} MB "
+            f"(CONVERT_MAX_RSS_MB); pruebe CONVERT_LOW_MEMORY=1 o divida el PDF")
+
+# ───────────────  DOCUMENTO PARSEADO (un solo open por PDF)  ───────────────
+class ParsedPage:
+    """Página de pdfplumber con `chars` y texto cacheados por x_tolerance."""
+
+    def __init__(self, page, stats: Optional[Dict[str, float]] = None,
+                 doc: Optional["ParsedPDF"] = None):
+        self.page = page
+        self.page_number = page.page_number
+        self._doc = doc
+        self._stats = stats if stats is not None else {}
+        self._chars: Optional[list] = None
+        self._text: Dict[Optional[float], str] = {}
+        self._coord_rows: Optional[List[Dict[str, str]]] = None
+        self._footer: Optional[List[str]] = None   # líneas de totales vistas por coord_rows
+        self._screen: Optional[Tuple[int, str]] = None
+        self._counted = False
+        # None = sin pre-filtrar, False = saltada (en pages_skipped), True = la leyó algún extractor
+        self._screened: Optional[bool] = None
+
+    def _analyzed(self, t0: float) -> None:
+        """Acumula tiempo de análisis de layout; cuenta chars la 1ª vez."""
+        st = self._stats
+        if self._chars is None:
+            self._chars = self.page.chars   # tras extract_text ya están parseados
+        st["text_s"] = st.get("text_s", 0.0) + time.perf_counter() - t0
+        if not self._counted:   # tras release() se re-analiza sin volver a contar
+            self._counted = True
+            st["pages"] = st.get("pages", 0) + 1
+            st["chars"] = st.get("chars", 0) + len(self._chars)
+
+    @property
+    def chars(self) -> list:
+        if self._chars is None:
+            self._analyzed(time.perf_counter())
+        return self._chars
+
+    def extract_text(self, x_tolerance: Optional[float] = None) -> str:
+        # None = tolerancia por defecto de pdfplumber
+        if x_tolerance not in self._text:
+            t0 = time.perf_counter()
+            kw = {} if x_tolerance is None else {"x_tolerance": x_tolerance}
+            self._text[x_tolerance] = self.page.extract_text(**kw) or ""
+            self._analyzed(t0)
+        return self._text[x_tolerance]
+
+    def cached_text(self) -> Optional[str]:
+        """Texto ya extraído (el de tolerancia por defecto si está), sin analizar; None si no se leyó."""
+        if None in self._text:
+            return self._text[None]
+        return next(iter(self._text.values()), None)
+
+    def coord_rows(self) -> List[Dict[str, str]]:
+        """Filas del extractor por coordenadas (LVMH) con las columnas del documento, una vez."""
+        if self._coord_rows is None:
+            bounds = self._doc.col_bounds() if self._doc is not None else COL_BOUNDS
+            if self._coord_rows is None:   # aprender las columnas pudo calcular esta página
+                self._footer = []
+                self._coord_rows = rows_from_page(self, bounds, self._footer)
+        return self._coord_rows
+
+    def screen(self) -> Tuple[int, str]:
+        """(dígitos, texto crudo en mayúsculas) del flujo de chars, sin armar líneas."""
+        if self._screen is None:
+            raw = "".join(c["text"] for c in self.chars)
+            self._screen = (sum(map(str.isdigit, raw)), raw.upper())
+        return self._screen
+
+    def may_have_items(self, layout: str) -> bool:
+        """
+        False si la página no puede tener filas del layout (ver ITEM_SCREENS):
+        el extractor la salta sin extract_text ni regex. pages_skipped cuenta
+        cada página una vez y solo si ningún extractor la leyó (el barrido
+        pregunta por cada extractor).
+        """
+        st = self._stats
+        if self._screen_pass(layout):
+            if self._screened is False:
+                st["pages_skipped"] -= 1
+            self._screened = True
+            return True
+        if self._screened is None:
+            self._screened = False
+            st["pages_skipped"] = st.get("pages_skipped", 0) + 1
+        return False
+
+    def _screen_pass(self, layout: str) -> bool:
+        if not PAGE_SCREEN:
+            return True
+        min_digits, marker = ITEM_SCREENS.get(layout, NO_SCREEN)
+        digits, raw = self.screen()
+        return digits >= min_digits and (marker is None or marker in raw)
+
+    def prime(self, texts: Dict[Optional[float], str],
+              coord_rows: Optional[List[Dict[str, str]]] = None,
+              screen: Optional[Tuple[int, str]] = None) -> None:
+        """Siembra la caché con resultados calculados en otro proceso."""
+        self._text.update(texts)
+        if coord_rows is not None:
+            self._coord_rows = coord_rows
+        if screen is not None:
+            self._screen = screen
+
+    def release(self) -> None:
+        """
+        Suelta los chars y los objetos de layout que pdfplumber cachea en la
+        página; quedan el texto por tolerancia, las filas por coordenadas y el
+        pre-filtro (calculado aquí si faltaba). Antes extrae lo que las
+        pasadas siguientes van a pedir (ParsedPDF.plan): con los objetos aún
+        vivos eso es armar texto, no volver a analizar la página. Si algo
+        vuelve a pedir chars, la página se re-analiza desde el PDF.
+        """
+        if self._chars is None:
+            return
+        doc = self._doc
+        if doc is not None:
+            for t in doc.keep_tols:
+                self.extract_text(t)
+            if any(self._screen_pass(l) for l in doc.keep_coords):
+                self.coord_rows()
+        self.screen()
+        self._chars = None
+        close = getattr(self.page, "close", None) or self.page.flush_cache
+        close()
+        self._stats["pages_released"] = self._stats.get("pages_released", 0) + 1
+
+
+class ParsedPDF:
+    """
+    PDF abierto una sola vez y compartido por todos los extractores:
+    el análisis de layout se hace una vez por página y por x_tolerance.
+    Acepta ruta, bytes o un objeto tipo archivo (stream del upload, mmap…);
+    los streams se leen en su sitio, sin copiarlos a disco.
+    """
+
+    def __init__(self, src, low_memory: Optional[bool] = None):
+        import pdfplumber
+        if isinstance(src, (bytes, bytearray, memoryview)):
+            src = BytesIO(src)
+        self._pdf = pdfplumber.open(src)
+        # text_s: segundos de análisis de layout; pages/chars: páginas analizadas aquí
+        self.stats: Dict[str, float] = {}
+        self.pages = [ParsedPage(p, self.stats, self) for p in self._pdf.pages]
+        self._col_bounds: Optional[Dict[str, Tuple[float, float]]] = None
+        if low_memory is None:
+            low_memory = LOW_MEMORY in ("1", "true", "on") or (
+                LOW_MEMORY == "auto" and len(self.pages) >= LOW_MEMORY_MIN_PAGES)
+        self.low_memory = low_memory
+        # lo que release() extrae antes de soltar una página (ver plan)
+        self.keep_tols: Tuple[Optional[float], ...] = (None,)
+        self.keep_coords: Tuple[str, ...] = ()
+
+    def plan(self, extractors: List["Extractor"], invoice: bool = True) -> None:
+        """
+        Tolerancias (las de `extractors`, 1.5 para los códigos faltantes y la
+        por defecto si falta leer el invoice) y layouts por coordenadas que el
+        resto del pipeline va a leer de cada página. Lo usan release() en
+        modo baja memoria y prefetch_pages.
+        """
+        self.keep_tols = tuple(dict.fromkeys(
+            (*((None,) if invoice else ()), 1.5, *chain.from_iterable(e.tolerances for e in extractors))))
+        self.keep_coords = tuple(e.name for e in extractors if e.coords)
+
+    def iter_pages(self, pages: Optional[List[ParsedPage]] = None) -> Iterator[ParsedPage]:
+        """
+        Recorre las páginas comprobando el techo de RSS; en modo baja memoria
+        suelta cada página (release) en cuanto el consumidor pide la siguiente,
+        así que solo hay una página con objetos de layout vivos a la vez.
+        """
+        for page in self.pages if pages is None else pages:
+            check_rss(f"página {page.page_number}/{len(self.pages)}")
+            yield page
+            if self.low_memory:
+                page.release()
+
+    def col_bounds(self) -> Dict[str, Tuple[float, float]]:
+        """Columnas del extractor por coordenadas: aprendidas de la cabecera o COL_BOUNDS."""
+        if self._col_bounds is None:
+            self._col_bounds = learn_col_bounds(self)
+        return self._col_bounds
+
+    def text(self, x_tolerance: Optional[float] = None) -> str:
+        return "\n".join(p.extract_text(x_tolerance) for p in self.iter_pages())
+
+    def close(self) -> None:
+        self._pdf.close()
+
+    def __enter__(self) -> "ParsedPDF":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+PDFSource = Union[str, bytes, BinaryIO, ParsedPDF]
+
+# ───────────────  PRE-FILTRO: páginas que no pueden tener ítems  ───────────────
+# layout → (mínimo de dígitos, marcador obligatorio en el flujo de chars).
+# Los mínimos salen de las regex de fila (p.ej. COTY: ref \d{8,14} + EAN
+# \d{12,14} = 20), así una página descartada nunca tiene una fila; los
+# marcadores son literales de la fila ("PZ", "KG", "Each") en mayúsculas.
+ITEM_SCREENS: Dict[str, Tuple[int, Optional[str]]] = {
+    "original":     (12,  None),     # EAN \d{12,14}
+    "lvmh":         (6,   None),     # ref \d{5,6} + un dígito de qty
+    "new_provider": (17,  "EACH"),   # ref \d{5,6} + UPC \d{12,14}
+    "interparfums": (0,   "PZ"),
+    "coty":         (20,  None),
+    "bulgari_asn":  (13,  "KG"),     # pos + ref \d{3,} + qty + HS \d{8,10}
+    "ipusa":        (6,   None),     # HS \d{6,10} | \d{4}.\d{2}.\d{4}
+}
+NO_SCREEN = (0, None)   # extractor sin entrada: no se salta ninguna página
+
+def item_pages(pdf: ParsedPDF, layout: str) -> Iterator[ParsedPage]:
+    """Páginas de pdf que pasan el pre-filtro de `layout`."""
+    return (p for p in pdf.iter_pages() if p.may_have_items(layout))
+
+@contextmanager
+def open_doc(src: PDFSource) -> Iterator[ParsedPDF]:
+    """Acepta ruta, bytes, stream o ParsedPDF; solo cierra lo que abrió aquí."""
+    if isinstance(src, ParsedPDF):
+        yield src
+    else:
+        with ParsedPDF(src) as doc:
+            yield doc
+
+
+# ───────────────  CABECERAS: lectura perezosa página a página  ───────────────
+HEADER_SCAN_PAGES = 3   # páginas que se prueban antes de buscar en el texto completo
+
+def iter_page_lines(pdf: ParsedPDF, x_tolerance: Optional[float] = None) -> Iterator[str]:
+    """Líneas no vacías (strip) en orden; extrae cada página solo si se llega a ella."""
+    for page in pdf.iter_pages():
+        for ln in page.extract_text(x_tolerance).split("\n"):
+            if ln.strip():
+                yield ln.strip()
+
+def search_header(pdf: ParsedPDF, pat: re.Pattern,
+                  x_tolerance: Optional[float] = None) -> Optional[re.Match]:
+    """
+    Igual que pat.search(pdf.text()), pero sin extraer todo el documento cuando
+    el campo está al principio: busca en el texto acumulado de las primeras
+    páginas y corta con el primer match que no llega al borde de lo leído
+    (uno que sí llega podría continuar en la página siguiente). Si no aparece
+    en HEADER_SCAN_PAGES páginas, busca en el texto completo.
+    """
+    n = len(pdf.pages)
+    txt = ""
+    for i, page in enumerate(pdf.iter_pages(pdf.pages[:HEADER_SCAN_PAGES])):
+        page_txt = page.extract_text(x_tolerance)
+        txt = f"{txt}\n{page_txt}" if i else page_txt
+        m = pat.search(txt)
+        if m and (m.end() < len(txt) or i == n - 1):
+            return m
+    if n <= HEADER_SCAN_PAGES:
+        return pat.search(txt)
+    return pat.search(pdf.text(x_tolerance))
+
+
 # ───────────────  UTIL: sacar número de invoice del PDF  ───────────────
 INV_RE = re.compile(r"(?:INVOICE|FACTURE|FACTURA)\s*(?:NO\.?|N°|NUMBER)?\s*[:\-]?\s*(\w[\w\-\/]{4,})", re.I)
 SIP_RE = re.compile(r"\bSIP(\d{6,})\b", re.I)
+_SIP_FILE_PAT = re.compile(r"SIP(\d+)")   # en el nombre del archivo (process_pdf)
 PO_RE  = re.compile(r"(?:ORDER|PO)\s*(?:NO\.?|N°|NUMBER)?\s*[:\-]?\s*(\w[\w\-\/]{4,})", re.I)
 
-def parse_invoice_number_from_pdf(pdf_path: str) -> str:
+_INV_HDR_PAT = re.compile(r"(INVOICE|FACTURA|FACTURE)", re.I)
+_INV_NO_PAT  = re.compile(r"(?:No\.?|N°|Number|Num\.?)\s*[:\-]?\s*(\S+)", re.I)
+# respaldo: primer "INVOICE … <token con dígito>" del documento (no cruza líneas)
+_INV_ANY_PAT = re.compile(r"(?:INVOICE|FACTURA|FACTURE)[^\n]{0,40}?([A-Z]*\d[\w\-\/]*)", re.I)
+_INV_TRIM    = re.compile(r"(^[^A-Z0-9]+|[^A-Z0-9\/\-]+$)", re.I)
+_FECHA_PAT   = re.compile(r"fech[aá]?", re.I)
+_WS_SPLIT    = re.compile(r"\s+")
+
+def parse_invoice_number_from_pdf(src: PDFSource) -> str:
     def _clean(tok: str) -> str:
-        return re.sub(r"(^[^A-Z0-9]+|[^A-Z0-9\/\-]+$)", "", tok.strip(), flags=re.I)
+        return _INV_TRIM.sub("", tok.strip())
 
     def _valid(tok: str) -> bool:
         if not tok:
             return False
-        if re.fullmatch(r"fech[aá]?", tok, flags=re.I):  # evita FECHA
+        if _FECHA_PAT.fullmatch(tok):  # evita FECHA
             return False
         return any(ch.isdigit() for ch in tok) and len(tok) >= 4
 
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            full = "\n".join((p.extract_text() or "") for p in pdf.pages)
-        lines = [ln.strip() for ln in full.split("\n") if ln.strip()]
-
-        hdr_pat = re.compile(r"(INVOICE|FACTURA|FACTURE)", re.I)
-        no_pat  = re.compile(r"(?:No\.?|N°|Number|Num\.?)\s*[:\-]?\s*(\S+)", re.I)
-        for ln in lines:
-            if not hdr_pat.search(ln):
-                continue
-            m = no_pat.search(ln)
-            if m:
-                cand = _clean(m.group(1))
-                if _valid(cand):
-                    return cand
-            for tok in re.split(r"\s+", ln):
-                tokc = _clean(tok)
-                if _valid(tokc):
-                    return tokc
-
-        m = re.search(r"(?:INVOICE|FACTURA|FACTURE)[^\n]{0,40}?([A-Z]*\d[\w\-\/]*)", full, re.I)
-        if m:
-            cand = _clean(m.group(1))
-            if _valid(cand):
-                return cand
+        with open_doc(src) as pdf:
+            # página a página: casi siempre está en la 1ª y no se lee el resto
+            fallback = None
+            for ln in iter_page_lines(pdf):
+                if not _INV_HDR_PAT.search(ln):
+                    continue
+                m = _INV_NO_PAT.search(ln)
+                if m:
+                    cand = _clean(m.group(1))
+                    if _valid(cand):
+                        return cand
+                for tok in _WS_SPLIT.split(ln):
+                    tokc = _clean(tok)
+                    if _valid(tokc):
+                        return tokc
+                if fallback is None and (m := _INV_ANY_PAT.search(ln)):
+                    fallback = _clean(m.group(1))
+
+        if fallback and _valid(fallback):
+            return fallback
     except Exception:
         pass
     return ""
 
 
+# ───────────────  LÍNEAS: regex de clasificación + contadores opt-in  ───────────────
+class LinePattern:
+    """
+    Regex de clasificación de líneas, compilada una vez a nivel de módulo y
+    registrada por nombre. match/search son los del patrón compilado (sin
+    capa Python por línea); con RE_STATS se envuelven para contar hits y
+    misses por patrón. El descarte barato va por página (ITEM_SCREENS), no
+    por línea: las regex ancladas ya fallan en C con el primer carácter.
+    """
+    __slots__ = ("name", "regex", "match", "search", "hits", "misses")
+
+    def __init__(self, name: str, regex: re.Pattern):
+        self.name, self.regex = name, regex
+        self.hits = self.misses = 0
+        self.match, self.search = regex.match, regex.search
+        if RE_STATS:
+            self.match, self.search = self._counted(regex.match), self._counted(regex.search)
+        LINE_PATTERNS[name] = self
+
+    def _counted(self, op: Callable[[str], Optional[re.Match]]) -> Callable[[str], Optional[re.Match]]:
+        def run(s: str) -> Optional[re.Match]:
+            m = op(s)
+            if m:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return m
+        return run
+
+    def __repr__(self) -> str:
+        return f"LinePattern({self.name!r}, hits={self.hits}, misses={self.misses})"
+
+LINE_PATTERNS: Dict[str, LinePattern] = {}
+
+def line_pattern_counts() -> Dict[str, int]:
+    """Contadores acumulados del proceso: {"re.<nombre>.hit|miss": n}; vacío sin RE_STATS."""
+    out = {}
+    if RE_STATS:
+        for name, p in LINE_PATTERNS.items():
+            out[f"re.{name}.hit"], out[f"re.{name}.miss"] = p.hits, p.misses
+    return out
+
+
 # ───────────────────────  PATRONES PARA CÓDIGOS  ────────────────────────────
 HTS_PAT = re.compile(r"^\d{6,10}$")
 UPC_PAT = re.compile(r"^\d{11,14}$")
@@ -77,20 +534,20 @@ PROF_PAT     = re.compile(r"PROFORMA[\s\S]*?(\d{6,})", re.I)
 ORDER_PAT_EN = re.compile(r"ORDER\s+NUMBER\D*(\d{6,})", re.I)
 ORDER_PAT_FR = re.compile(r"N°\s*DE\s*COMMANDE\D*(\d{6,})", re.I)
 PLV_PAT      = re.compile(r"FACTURE\s+SANS\s+PAIEMENT|INVOICE\s+WITHOUT\s+PAYMENT", re.I)
-ORG_PAT      = re.compile(r"PAYS D['’]?ORIGINE[^:]*:\s*(.+)", re.I)
+ORG_PAT      = LinePattern("org_fr", re.compile(r"PAYS D['’]?ORIGINE[^:]*:\s*(.+)", re.I))
 
 # NUEVO: patrón para capturar el Your Order Nr en las proformas Dior
 ORDER_NR_PAT = re.compile(r"V/CDE[-\s]?Y/ORD\s*Nr\s*:\s*(.+)", re.I)
 
-ROW_FACT = re.compile(
+ROW_FACT = LinePattern("row_fact", re.compile(
     r"^([A-Z]\w{3,11})\s+(\d{12,14})\s+(\d{6,9})\s+(\d[\d.,]*)\s+([\d.,]+)\s+([\d.,]+)\s*$"
-)
-ROW_PROF_DIOR = re.compile(
+))
+ROW_PROF_DIOR = LinePattern("row_prof_dior", re.compile(
     r"^([A-Z]\w{3,11})\s+(\d{12,14})\s+(\d{6,10})\s+(\d[\d.,]*)\s+([\d.,]+)\s+([\d.,]+)\s*$"
-)
-ROW_PROF = re.compile(
+))
+ROW_PROF = LinePattern("row_prof", re.compile(
     r"^([A-Z]\w{3,11})\s+(\d{12,14})\s+([\d.,]+)\s+([\d.,]+)\s*$"
-)
+))
 
 def fnum(s: str) -> float:
     return float(s.strip().replace(".", "").replace(",", ".")) if s and s.strip() else 0.0
@@ -99,10 +556,10 @@ def doc_kind(text: str) -> str:
     up = text.upper()
     return "proforma" if "PROFORMA" in up or ("ACKNOWLEDGE" in up and "RECEPTION" in up) else "factura"
 
-def extract_original(pdf_path: str) -> List[dict]:
+def extract_original(src: PDFSource) -> List[LineItem]:
     rows = []
-    with pdfplumber.open(pdf_path) as pdf:
-        all_txt = "\n".join(page.extract_text() or "" for page in pdf.pages)
+    with open_doc(src) as pdf:
+        all_txt = pdf.text()
         kind = doc_kind(all_txt)
 
         inv_global = ""
@@ -125,77 +582,82 @@ def extract_original(pdf_path: str) -> List[dict]:
         # Buscar el Your Order Nr en todo el texto
         if mo := ORDER_NR_PAT.search(all_txt):
             your_order_nr = mo.group(1).strip()
+        del all_txt   # de aquí en adelante solo hacen falta los campos de cabecera
 
         invoice_full = inv_global + ("PLV" if plv_global else "")
         org_global = ""
 
-        for page in pdf.pages:
-            lines = (page.extract_text() or "").split("\n")
+        for page in pdf.iter_pages():
+            lines = page.extract_text().split("\n")
             # país de origen
             for ln in lines:
                 if mo := ORG_PAT.search(ln):
                     val = mo.group(1).strip()
                     if val:
                         org_global = val
+            # el texto ya se extrajo (doc_kind/ORG); el pre-filtro ahorra el bucle de filas
+            if not page.may_have_items("original"):
+                continue
 
             for i, raw in enumerate(lines):
                 ln = raw.strip()
                 if kind == "factura" and (mf := ROW_FACT.match(ln)):
                     ref, ean, custom, qty_s, unit_s, tot_s = mf.groups()
                     desc = lines[i+1].strip() if i+1 < len(lines) and not ROW_FACT.match(lines[i+1]) else ""
-                    rows.append({
-                        "Reference": ref,
-                        "Code EAN": ean,
-                        "Custom Code": custom,
-                        "Description": desc,
-                        "Origin": org_global,
-                        "Quantity": int(qty_s.replace(".", "").replace(",", "")),
-                        "Unit Price": fnum(unit_s),
-                        "Total Price": fnum(tot_s),
-                        "Invoice Number": invoice_full,
-                        "Your Order Nr": your_order_nr,   # <── agregado
-                    })
+                    rows.append(LineItem(
+                        ref=ref,
+                        ean=ean,
+                        custom=custom,
+                        desc=desc,
+                        origin=org_global,
+                        qty=int(qty_s.replace(".", "").replace(",", "")),
+                        unit=fnum(unit_s),
+                        total=fnum(tot_s),
+                        invoice=invoice_full,
+                        order_nr=your_order_nr,   # <── agregado
+                    ))
                 elif kind == "proforma" and (mpd := ROW_PROF_DIOR.match(ln)):
                     ref, ean, custom, qty_s, unit_s, tot_s = mpd.groups()
                     desc = lines[i+1].strip() if i+1 < len(lines) else ""
-                    rows.append({
-                        "Reference": ref,
-                        "Code EAN": ean,
-                        "Custom Code": custom,
-                        "Description": desc,
-                        "Origin": org_global,
-                        "Quantity": int(qty_s.replace(".", "").replace(",", "")),
-                        "Unit Price": fnum(unit_s),
-                        "Total Price": fnum(tot_s),
-                        "Invoice Number": invoice_full,
-                        "Your Order Nr": your_order_nr,
-                    })
+                    rows.append(LineItem(
+                        ref=ref,
+                        ean=ean,
+                        custom=custom,
+                        desc=desc,
+                        origin=org_global,
+                        qty=int(qty_s.replace(".", "").replace(",", "")),
+                        unit=fnum(unit_s),
+                        total=fnum(tot_s),
+                        invoice=invoice_full,
+                        order_nr=your_order_nr,
+                    ))
                 elif kind == "proforma" and (mp := ROW_PROF.match(ln)):
                     ref, ean, unit_s, qty_s = mp.groups()
                     qty = int(qty_s.replace(".", "").replace(",", ""))
                     unit = fnum(unit_s)
                     desc = lines[i+1].strip() if i+1 < len(lines) else ""
-                    rows.append({
-                        "Reference": ref,
-                        "Code EAN": ean,
-                        "Custom Code": "",
-                        "Description": desc,
-                        "Origin": org_global,
-                        "Quantity": qty,
-                        "Unit Price": unit,
-                        "Total Price": unit * qty,
-                        "Invoice Number": invoice_full,
-                        "Your Order Nr": your_order_nr,
-                    })
+                    rows.append(LineItem(
+                        ref=ref,
+                        ean=ean,
+                        custom="",
+                        desc=desc,
+                        origin=org_global,
+                        qty=qty,
+                        unit=unit,
+                        total=unit * qty,
+                        invoice=invoice_full,
+                        order_nr=your_order_nr,
+                        derived=True,
+                    ))
 
     # completar Origin si hay uno solo por invoice
     inv2org = defaultdict(set)
     for r in rows:
-        if r["Origin"]:
-            inv2org[r["Invoice Number"]].add(r["Origin"])
+        if r.origin:
+            inv2org[r.invoice].add(r.origin)
     for r in rows:
-        if not r["Origin"] and len(inv2org[r["Invoice Number"]]) == 1:
-            r["Origin"] = next(iter(inv2org[r["Invoice Number"]]))
+        if not r.origin and len(inv2org[r.invoice]) == 1:
+            r.origin = next(iter(inv2org[r.invoice]))
     return rows
 
 
@@ -233,7 +695,9 @@ def to_float2(txt: str) -> float:
 def to_int2(txt: str) -> int:
     return int(txt.replace(",","").replace(".","") or 0)
 
-def rows_from_page(page) -> List[Dict[str,str]]:
+def _rows_from_page_py(page, bounds: Dict[str, Tuple[float, float]] = COL_BOUNDS,
+                       footer: Optional[List[str]] = None) -> List[Dict[str,str]]:
+    """Versión de referencia (sin numpy): un bucle Python por carácter."""
     rows=[]
     grouped={}
     for ch in page.chars:
@@ -241,13 +705,15 @@ def rows_from_page(page) -> List[Dict[str,str]]:
 
     for _,chs in sorted(grouped.items()):
         line_txt="".join(c["text"] for c in sorted(chs,key=lambda c:c["x0"]))
+        if footer is not None and FOOTER_PAT.match(line_txt):
+            footer.append(line_txt)
         if not line_txt.strip() or any(sn in line_txt for sn in SKIP_SNIPPETS):
             continue
 
-        cols={k:"" for k in COL_BOUNDS}
+        cols={k:"" for k in bounds}
         for c in sorted(chs,key=lambda c:c["x0"]):
             xm=(c["x0"]+c["x1"])/2
-            for key,(x0,x1) in COL_BOUNDS.items():
+            for key,(x0,x1) in bounds.items():
                 if x0<=xm<x1:
                     cols[key]+=c["text"]
                     break
@@ -263,35 +729,287 @@ def rows_from_page(page) -> List[Dict[str,str]]:
 
     return rows
 
-def extract_slice(pdf_path: str, inv_number: str) -> List[dict]:
+def _col_index(bounds: Dict[str, Tuple[float, float]]) -> Tuple[List[str], List[float], List[float]]:
+    """Bordes de columna ordenados para np.searchsorted: (claves, inicios, fines)."""
+    keys = sorted(bounds, key=lambda k: bounds[k][0])
+    return keys, [bounds[k][0] for k in keys], [bounds[k][1] for k in keys]
+
+_CHAR_GEOM  = itemgetter("top", "x0", "x1")
+_CHAR_TEXT  = itemgetter("text")
+
+np = None               # numpy, cargado por _numpy() la primera vez que hace falta
+_NUMPY_LOADED = False
+
+def _numpy():
+    """Importa numpy al primer uso; None si no está (se usa el bucle puro)."""
+    global np, _NUMPY_LOADED
+    if not _NUMPY_LOADED:
+        _NUMPY_LOADED = True
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        np = numpy
+    return np
+
+def _round1(a):
+    """round(x, 1) de Python vectorizado; los casos ~.x5 se resuelven con round()."""
+    r = np.round(a, 1)
+    t = a * 10
+    edge = np.flatnonzero(np.abs(t - np.floor(t) - 0.5) < 1e-6)
+    if edge.size:
+        r[edge] = [round(v, 1) for v in a[edge].tolist()]
+    return r
+
+def rows_from_page(page, bounds: Dict[str, Tuple[float, float]] = COL_BOUNDS,
+                   footer: Optional[List[str]] = None) -> List[Dict[str,str]]:
+    """
+    Filas por coordenadas en forma columnar: x0/x1/top a arrays NumPy, un
+    lexsort (línea, x0) para el orden y np.searchsorted contra los bordes
+    de columna para asignar cada carácter. Mismo resultado que
+    _rows_from_page_py. Si se pasa `footer`, agrega ahí las líneas de
+    totales (FOOTER_PAT) para reconcile: esta página no tiene texto extraído.
+    """
+    chars = page.chars
+    if _numpy() is None or not chars:
+        return _rows_from_page_py(page, bounds, footer)
+    col_keys, col_starts, col_ends = _col_index(bounds)
+
+    n = len(chars)
+    geom = np.fromiter(chain.from_iterable(map(_CHAR_GEOM, chars)), float, 3 * n).reshape(n, 3)
+    top, x0, x1 = _round1(geom[:, 0]), geom[:, 1], geom[:, 2]
+    texts = list(map(_CHAR_TEXT, chars))
+
+    order = np.lexsort((x0, top))                  # estable: empates en x0 como en page.chars
+    text  = [texts[i] for i in order.tolist()]
+    top   = top[order]
+    xm    = (x0[order] + x1[order]) / 2
+
+    col = np.searchsorted(col_starts, xm, side="right") - 1
+    ok  = col >= 0
+    ok[ok] = xm[ok] < np.asarray(col_ends)[col[ok]]
+    col[~ok] = -1
+
+    cuts = (np.flatnonzero(np.diff(top)) + 1).tolist()
+    line_bounds = list(zip([0] + cuts, cuts + [n]))
+
+    # agrupa (línea, columna) con un sort estable: cada grupo queda en orden x0
+    line_id = np.repeat(np.arange(len(line_bounds)), np.diff([0] + cuts + [n]))
+    seg_order = np.lexsort((col, line_id))
+    seg_line = line_id[seg_order]
+    seg_col  = col[seg_order]
+    seg_cuts = (np.flatnonzero((np.diff(seg_line) != 0) | (np.diff(seg_col) != 0)) + 1).tolist()
+    seg_text = [text[i] for i in seg_order.tolist()]
+    seg_starts = [0] + seg_cuts
+    line_cols: List[Dict[str, str]] = [{k: "" for k in bounds} for _ in line_bounds]
+    for a, b, li, c in zip(seg_starts, seg_cuts + [n],
+                           seg_line[seg_starts].tolist(), seg_col[seg_starts].tolist()):
+        if c >= 0:
+            line_cols[li][col_keys[c]] = "".join(seg_text[a:b])
+
+    rows=[]
+    for (a, b), cols in zip(line_bounds, line_cols):
+        line_txt="".join(text[a:b])
+        if footer is not None and FOOTER_PAT.match(line_txt):
+            footer.append(line_txt)
+        if not line_txt.strip() or any(sn in line_txt for sn in SKIP_SNIPPETS):
+            continue
+        cols={k:clean(v) for k,v in cols.items()}
+
+        # Caso 1: fila normal con referencia y cantidad
+        if cols["ref"] and REF_PAT.match(cols["ref"]) and NUM_PAT.search(cols["qty"]):
+            rows.append(cols)
+
+        # Caso 2: línea sin referencia → se trata como descripción extendida
+        elif not cols["ref"] and rows:
+            rows[-1]["desc"] = (rows[-1]["desc"] + " " + line_txt.strip()).strip()
+
+    return rows
+
+# ───────────  COLUMNAS APRENDIDAS: bordes desde la fila de cabecera  ───────────
+# Palabras de cabecera aceptadas por columna, en el orden de la tabla
+HEADER_WORDS = [
+    ("ref",   ("NO", "ITEM", "REF", "REFERENCE")),
+    ("desc",  ("DESCRIPTION",)),
+    ("upc",   ("UPC", "EAN")),
+    ("ctry",  ("CTRY", "COUNTRY", "ORIGIN", "COO")),
+    ("hs",    ("HS", "HTS", "TARIFF")),
+    ("qty",   ("QTY", "QUANTITY")),
+    ("unit",  ("UNIT", "PRICE")),
+    ("total", ("TOTAL", "AMOUNT")),
+]
+HEADER_COL_MARGIN = 6.0   # pt antes de cada título (números alineados a la derecha)
+WORD_GAP          = 1.5   # pt entre chars que separa palabras
+
+def _line_words(chs: list) -> List[Tuple[str, float, float]]:
+    """(texto, x0, x1) de cada palabra de una línea de chars ordenada por x0."""
+    words, cur, x0, x1 = [], "", 0.0, 0.0
+    for c in chs:
+        if c["text"].isspace() or (cur and c["x0"] - x1 > WORD_GAP):
+            if cur:
+                words.append((cur, x0, x1))
+            cur = ""
+        if not c["text"].isspace():
+            if not cur:
+                x0 = c["x0"]
+            cur += c["text"]
+            x1 = c["x1"]
+    if cur:
+        words.append((cur, x0, x1))
+    return words
+
+def find_header_columns(page: ParsedPage) -> Optional[List[Tuple[str, float, float]]]:
+    """
+    Busca en los chars la fila de cabecera de la tabla (la que tiene
+    "Description" y todas las columnas de HEADER_WORDS en orden) y devuelve
+    (columna, x0, x1) del título de cada una, o None.
+    """
+    lines: Dict[float, list] = {}
+    for c in page.chars:
+        lines.setdefault(round(c["top"], 1), []).append(c)
+    for _, chs in sorted(lines.items()):
+        if "DESCRIPTION" not in "".join(c["text"] for c in chs).upper():
+            continue
+        chs.sort(key=itemgetter("x0"))
+        found, k = [], 0
+        for txt, x0, x1 in _line_words(chs):
+            if k < len(HEADER_WORDS) and txt.upper().strip(".:#") in HEADER_WORDS[k][1]:
+                found.append((HEADER_WORDS[k][0], x0, x1))
+                k += 1
+        if k == len(HEADER_WORDS):
+            return found
+    return None
+
+def bounds_from_header(cols: List[Tuple[str, float, float]], width: float) -> Dict[str, Tuple[float, float]]:
+    """
+    Bordes contiguos: cada columna empieza HEADER_COL_MARGIN antes de su
+    título (sin pasar el punto medio con el título anterior) y termina donde
+    empieza la siguiente; la primera desde 0 y la última hasta el ancho.
+    """
+    starts = [0.0]
+    for (_, _, prev_x1), (_, x0, _) in zip(cols, cols[1:]):
+        starts.append(max((prev_x1 + x0) / 2, x0 - HEADER_COL_MARGIN))
+    ends = starts[1:] + [max(float(width), cols[-1][2]) + 1]
+    return {key: (a, b) for (key, _, _), a, b in zip(cols, starts, ends)}
+
+class ColumnTemplateCache:
+    """
+    Plantillas de columnas por huella de proveedor (títulos + posiciones +
+    tamaño de página): en memoria y, si la caché de resultados está activa,
+    en CACHE_DIR/col-templates para los siguientes uploads y procesos.
+    None = se comprobó que COL_BOUNDS funciona mejor.
+    """
+    MISS = object()
+
+    def __init__(self, root: str = os.path.join(CACHE_DIR, "col-templates"),
+                 enabled: bool = CACHE_MAX_MB > 0):
+        self.root = root if enabled else None
+        self.mem: Dict[str, Optional[Dict[str, Tuple[float, float]]]] = {}
+
+    @staticmethod
+    def fingerprint(page: ParsedPage, cols: List[Tuple[str, float, float]]) -> str:
+        sig = "|".join(f"{k}:{x0:.0f}" for k, x0, _ in cols)
+        raw = f"{EXTRACTOR_VERSION}|{float(page.page.width):.0f}x{float(page.page.height):.0f}|{sig}"
+        return hashlib.sha256(raw.encode()).hexdigest()[:24]
+
+    def get(self, fp: str):
+        if fp in self.mem:
+            return self.mem[fp]
+        if self.root:
+            try:
+                with open(os.path.join(self.root, fp + ".json"), encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                return self.MISS
+            bounds = data["bounds"] and {k: tuple(v) for k, v in data["bounds"].items()}
+            self.mem[fp] = bounds
+            return bounds
+        return self.MISS
+
+    def put(self, fp: str, bounds: Optional[Dict[str, Tuple[float, float]]]) -> None:
+        self.mem[fp] = bounds
+        if not self.root:
+            return
+        path = os.path.join(self.root, fp + ".json")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"bounds": bounds}, f)
+            os.replace(tmp, path)
+        except OSError:
+            logging.warning("No se pudo guardar la plantilla %s", path, exc_info=True)
+
+col_templates = ColumnTemplateCache()
+
+_CTRY_PAT  = re.compile(r"^[A-Z]{2,3}$")
+_MONEY_PAT = re.compile(r"^[\d.,\u202f ]*\d$")
+
+def coord_rows_score(rows: List[Dict[str, str]]) -> int:
+    """Campos con forma válida (ref, UPC, país, HS, qty, unit, total) en las filas."""
+    return sum(bool(REF_PAT.match(r["ref"])) + bool(UPC_PAT.match(r["upc"]))
+               + bool(_CTRY_PAT.match(r["ctry"])) + bool(HTS_PAT.match(r["hs"].replace(".", "")))
+               + r["qty"].replace(",", "").isdigit()
+               + bool(_MONEY_PAT.match(r["unit"])) + bool(_MONEY_PAT.match(r["total"]))
+               for r in rows)
+
+def learn_col_bounds(doc: ParsedPDF) -> Dict[str, Tuple[float, float]]:
+    """
+    Columnas del documento, una vez: toma la primera fila de cabecera de las
+    primeras HEADER_SCAN_PAGES páginas y deduce los bordes. La plantilla solo
+    se usa si en esa página da filas mejor formadas (coord_rows_score) que
+    COL_BOUNDS; la decisión queda en col_templates por huella del proveedor.
+    Sin cabecera: COL_BOUNDS.
+    """
+    for page in doc.pages[:HEADER_SCAN_PAGES]:
+        cols = find_header_columns(page)
+        if cols is None:
+            continue
+        fp = col_templates.fingerprint(page, cols)
+        hit = col_templates.get(fp)
+        if hit is not ColumnTemplateCache.MISS:
+            doc.stats["col_template_hits"] = doc.stats.get("col_template_hits", 0) + 1
+            return hit or COL_BOUNDS
+        learned = bounds_from_header(cols, page.page.width)
+        page._footer = []
+        rows_learned = rows_from_page(page, learned, page._footer)
+        rows_default = rows_from_page(page, COL_BOUNDS)
+        best = learned if coord_rows_score(rows_learned) > coord_rows_score(rows_default) else None
+        col_templates.put(fp, best)
+        page._coord_rows = rows_learned if best else rows_default   # ya calculadas
+        logging.info("Columnas %s (huella %s)", "aprendidas" if best else "por defecto", fp[:8])
+        return best or COL_BOUNDS
+    return COL_BOUNDS
+
+def extract_slice(src: PDFSource, inv_number: str) -> List[LineItem]:
     rows=[]
     your_order_nr=""
 
-    with pdfplumber.open(pdf_path) as pdf:
-        full_txt="\n".join(page.extract_text() or "" for page in pdf.pages)
-        if mo := ORDER_NR_PAT2.search(full_txt):
+    with open_doc(src) as pdf:
+        # solo la cabecera: las filas salen de page.chars, no del texto
+        if mo := search_header(pdf, ORDER_NR_PAT2):
             your_order_nr = mo.group(1).strip()
 
-        for page in pdf.pages:
-            for r in rows_from_page(page):
-                rows.append({
-                    "Reference": r.get("ref",""),
-                    "Code EAN": r.get("upc",""),
-                    "Custom Code": r.get("hs",""),
-                    "Description": r.get("desc",""),
-                    "Origin": r.get("ctry",""),
-                    "Quantity": to_int2(r.get("qty","0")),
-                    "Unit Price": to_float2(r.get("unit","0")),
-                    "Total Price": to_float2(r.get("total","0")),
-                    "Invoice Number": inv_number,
-                    "Your Order Nr": your_order_nr  # <── agregado fijo
-                })
+        for page in item_pages(pdf, "lvmh"):
+            for r in page.coord_rows():
+                rows.append(LineItem(
+                    ref=r.get("ref",""),
+                    ean=r.get("upc",""),
+                    custom=r.get("hs",""),
+                    desc=r.get("desc",""),
+                    origin=r.get("ctry",""),
+                    qty=to_int2(r.get("qty","0")),
+                    unit=to_float2(r.get("unit","0")),
+                    total=to_float2(r.get("total","0")),
+                    invoice=inv_number,
+                    order_nr=your_order_nr  # <── agregado fijo
+                ))
     return rows
 
 
 
 # ─────────────────────  EXTRACTOR 3  (proveedor nuevo)  ──────────────────────
-pattern_full = re.compile(r"""
+pattern_full = LinePattern("new_provider_full", re.compile(r"""
     ^\s*
     (?P<ref>\d{5,6}[A-Z]?)\s+
     (?P<desc>.+?)\s+
@@ -303,9 +1021,9 @@ pattern_full = re.compile(r"""
     (?P<unit>[\d.,]+)\s+
     (?:-|(?P<posm>[\d.,]+))\s+
     (?P<total>[\d.,]+)
-    """, re.VERBOSE)
+    """, re.VERBOSE))
 
-pattern_nohs = re.compile(r"""
+pattern_nohs = LinePattern("new_provider_nohs", re.compile(r"""
     ^\s*
     (?P<ref>\d{5,6}[A-Z]?)\s+
     (?P<desc>.+?)\s+
@@ -316,9 +1034,9 @@ pattern_nohs = re.compile(r"""
     (?P<unit>[\d.,]+)\s+
     (?:-|(?P<posm>[\d.,]+))\s+
     (?P<total>[\d.,]+)
-    """, re.VERBOSE)
+    """, re.VERBOSE))
 
-pattern_basic = re.compile(r"""
+pattern_basic = LinePattern("new_provider_basic", re.compile(r"""
     ^\s*
     (?P<ref>\d{5,6}[A-Z]?)\s+
     (?P<upc>\d{12,14})\s+
@@ -329,16 +1047,21 @@ pattern_basic = re.compile(r"""
     (?P<unit>[\d.,]+)\s+
     (?:-|(?P<posm>[\d.,]+))\s+
     (?P<total>[\d.,]+)
-    """, re.VERBOSE)
+    """, re.VERBOSE))
 
-def extract_new_provider(pdf_path: str, inv_number: str) -> List[dict]:
+_HAS_ALPHA = re.compile(r"[A-Za-z]")
+_NEW_PROVIDER_SKIP = ("Country of", "Customer PO", "Order No",
+                      "Shipping Terms", "Bill To", "Finance",
+                      "Total", "CIF", "Ship To")
+
+def extract_new_provider(src: PDFSource, inv_number: str) -> List[LineItem]:
     def new_fnum(s: str) -> float:
         return float(s.replace(",", "")) if s.strip() else 0.0
 
     rows=[]
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            txt = page.extract_text() or ""
+    with open_doc(src) as pdf:
+        for page in item_pages(pdf, "new_provider"):
+            txt = page.extract_text()
             if "No. Description" not in txt:
                 continue
             pending_desc=None
@@ -349,66 +1072,68 @@ def extract_new_provider(pdf_path: str, inv_number: str) -> List[dict]:
 
                 if m := pattern_full.match(ln):
                     d=m.groupdict()
-                    rows.append({
-                        "Reference": d["ref"],
-                        "Code EAN": d["upc"],
-                        "Custom Code": d["hs"],
-                        "Description": d["desc"].strip(),
-                        "Origin": d["ctry"],
-                        "Quantity": int(d["qty"].replace(",","")),
-                        "Unit Price": new_fnum(d["unit"]),
-                        "Total Price": new_fnum(d["total"]),
-                        "Invoice Number": inv_number
-                    })
+                    rows.append(LineItem(
+                        ref=d["ref"],
+                        ean=d["upc"],
+                        custom=d["hs"],
+                        desc=d["desc"].strip(),
+                        origin=d["ctry"],
+                        qty=int(d["qty"].replace(",","")),
+                        unit=new_fnum(d["unit"]),
+                        total=new_fnum(d["total"]),
+                        invoice=inv_number
+                    ))
                     pending_desc=None
                     continue
 
                 if m2 := pattern_nohs.match(ln):
                     d=m2.groupdict()
-                    rows.append({
-                        "Reference": d["ref"],
-                        "Code EAN": d["upc"],
-                        "Custom Code": "",
-                        "Description": d["desc"].strip(),
-                        "Origin": d["ctry"],
-                        "Quantity": int(d["qty"].replace(",","")),
-                        "Unit Price": new_fnum(d["unit"]),
-                        "Total Price": new_fnum(d["total"]),
-                        "Invoice Number": inv_number
-                    })
+                    rows.append(LineItem(
+                        ref=d["ref"],
+                        ean=d["upc"],
+                        custom="",
+                        desc=d["desc"].strip(),
+                        origin=d["ctry"],
+                        qty=int(d["qty"].replace(",","")),
+                        unit=new_fnum(d["unit"]),
+                        total=new_fnum(d["total"]),
+                        invoice=inv_number
+                    ))
                     pending_desc=None
                     continue
 
                 if mb := pattern_basic.match(ln):
                     if pending_desc:
                         d=mb.groupdict()
-                        rows.append({
-                            "Reference": d["ref"],
-                            "Code EAN": d["upc"],
-                            "Custom Code": d["hs"],
-                            "Description": pending_desc.strip(),
-                            "Origin": d["ctry"],
-                            "Quantity": int(d["qty"].replace(",","")),
-                            "Unit Price": new_fnum(d["unit"]),
-                            "Total Price": new_fnum(d["total"]),
-                            "Invoice Number": inv_number
-                        })
+                        rows.append(LineItem(
+                            ref=d["ref"],
+                            ean=d["upc"],
+                            custom=d["hs"],
+                            desc=pending_desc.strip(),
+                            origin=d["ctry"],
+                            qty=int(d["qty"].replace(",","")),
+                            unit=new_fnum(d["unit"]),
+                            total=new_fnum(d["total"]),
+                            invoice=inv_number
+                        ))
                         pending_desc=None
                     continue
 
-                if re.search(r"[A-Za-z]", ln_s):
-                    skip_pref=("Country of","Customer PO","Order No",
-                               "Shipping Terms","Bill To","Finance",
-                               "Total","CIF","Ship To")
-                    if not any(ln_s.startswith(p) for p in skip_pref):
+                if _HAS_ALPHA.search(ln_s):
+                    if not ln_s.startswith(_NEW_PROVIDER_SKIP):
                         pending_desc=(pending_desc+" "+ln_s) if pending_desc else ln_s
     return rows
 
 # ──────────────────  EXTRACTOR 4 (Interparfums Italia: totales inline)  ─────
-HS_ORG_PAT = re.compile(r"HS\s*Code:\s*(?P<hs>\d{8,14})\s*,\s*Origin:\s*(?P<org>[A-Z]{2})", re.I)
-EAN_PAT    = re.compile(r"EAN\s*Code:\s*(?P<ean>\d{12,14})", re.I)
-
-HEAD_INLINE_PAT = re.compile(
+HS_ORG_PAT = LinePattern("interparfums_hs_org", re.compile(
+    r"HS\s*Code:\s*(?P<hs>\d{8,14})\s*,\s*Origin:\s*(?P<org>[A-Z]{2})", re.I
+))
+EAN_PAT    = LinePattern("interparfums_ean", re.compile(
+    r"EAN\s*Code:\s*(?P<ean>\d{12,14})", re.I
+))
+
+# fila: unidad "PZ" obligatoria
+HEAD_INLINE_PAT = LinePattern("interparfums_head", re.compile(
     r"""^
     (?P<ref>[A-Z0-9]{3,}\w*)\s+
     (?P<desc>.+?)\s+
@@ -421,7 +1146,7 @@ HEAD_INLINE_PAT = re.compile(
     \s+(?P<vat>[A-Z]{2})\s*$
     """,
     re.X | re.I
-)
+))
 
 def _fnum_euro(s: str) -> float:
     if not s: return 0.0
@@ -438,11 +1163,11 @@ def _fnum_euro(s: str) -> float:
 def _qty_to_int(s: str) -> int:
     return int(s.replace("\u202f","").replace(" ","").replace(".","").replace(",","") or 0)
 
-def extract_interparfums_blocks(pdf_path: str, invoice_number: str) -> List[dict]:
-    rows: List[dict] = []
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            lines = [ (page.extract_text() or "").replace("\u202f"," ").split("\n") ][0]
+def extract_interparfums_blocks(src: PDFSource, invoice_number: str) -> List[LineItem]:
+    rows: List[LineItem] = []
+    with open_doc(src) as pdf:
+        for page in item_pages(pdf, "interparfums"):
+            lines = [ page.extract_text().replace("\u202f"," ").split("\n") ][0]
             for i, raw in enumerate(lines):
                 line = raw.strip()
                 if not line:
@@ -475,17 +1200,17 @@ def extract_interparfums_blocks(pdf_path: str, invoice_number: str) -> List[dict
                     if hs and org and ean:
                         break
 
-                rows.append({
-                    "Reference": ref,
-                    "Code EAN": ean,
-                    "Custom Code": hs,
-                    "Description": desc,
-                    "Origin": org,
-                    "Quantity": qty,
-                    "Unit Price": unit,
-                    "Total Price": total,
-                    "Invoice Number": invoice_number
-                })
+                rows.append(LineItem(
+                    ref=ref,
+                    ean=ean,
+                    custom=hs,
+                    desc=desc,
+                    origin=org,
+                    qty=qty,
+                    unit=unit,
+                    total=total,
+                    invoice=invoice_number
+                ))
     return rows
 
 # ─────────────────────  EXTRACTOR 5 (COTY, robusto) ─────────────────────
@@ -495,35 +1220,34 @@ def extract_interparfums_blocks(pdf_path: str, invoice_number: str) -> List[dict
 #  • Ítems en una sola línea:   ref  ean  desc  qty  unit  total
 #  • Ítems en dos líneas:       (cabecera) + (qty unit total)
 #  • Totales con * o ** (FOC)
-import re
 
 # Cabeceras de tabla y cortes
-_COTY_TABLE_HDR = re.compile(
+_COTY_TABLE_HDR = LinePattern("coty_table_hdr", re.compile(
     r"^(Ref\.\s*No\.|Ref\.\s*No\.\s*Customer|EAN\s*Code\s*Article|EAN\s*Code\s*Material)",
     re.I
-)
-_COTY_END_ROW   = re.compile(r"^(subtotal|total|carry\s*forward)", re.I)
+))
+_COTY_END_ROW   = LinePattern("coty_end_row", re.compile(r"^(subtotal|total|carry\s*forward)", re.I))
 
 # Una sola línea con todo (ref/ean/desc/qty/unit/total)
-_COTY_ONE_LINE = re.compile(
+_COTY_ONE_LINE = LinePattern("coty_one_line", re.compile(
     r"^\s*(?P<ref>\d{8,14})\s+(?P<ean>\d{12,14})\s+(?P<desc>.+?)\s+"
     r"(?P<qty>\d{1,6})\s+(?P<unit>[\d\.,\s]+?)\s+(?P<total>[\d\.,]+)(?:\*+)?\s*$"
-)
+))
 
 # Variante en dos líneas: primero solo cabecera ref/ean/desc…
-_COTY_HEAD_ONLY = re.compile(
+_COTY_HEAD_ONLY = LinePattern("coty_head_only", re.compile(
     r"^\s*(?P<ref>\d{8,14})\s+(?P<ean>\d{12,14})\s+(?P<desc>.+?)\s*$"
-)
+))
 
 # …y después cantidades/precio/total
-_COTY_NUMS = re.compile(
+_COTY_NUMS = LinePattern("coty_nums", re.compile(
     r"^\s*(?P<qty>\d{1,6})\s+(?P<unit>[\d\.\,\s]+)\s+(?P<total>[\d\.,]+)(?:\*+)?\s*$"
-)
+))
 
 # HS y Origen (pueden aparecer entre cabecera y números, o tras la línea completa)
-_COTY_HS    = re.compile(r"\(\s*H\s*S\s*No\.?\s*(?P<hs>\d{6,14})\s*\)", re.I)
-_COTY_ORGES = re.compile(r"Pa[ií]s\s+de\s+origen:\s*(?P<org>.+)", re.I)
-_COTY_ORGEN = re.compile(r"Country\s+of\s+origin:\s*(?P<org>.+)", re.I)
+_COTY_HS    = LinePattern("coty_hs", re.compile(r"\(\s*H\s*S\s*No\.?\s*(?P<hs>\d{6,14})\s*\)", re.I))
+_COTY_ORGES = LinePattern("coty_org_es", re.compile(r"Pa[ií]s\s+de\s+origen:\s*(?P<org>.+)", re.I))
+_COTY_ORGEN = LinePattern("coty_org_en", re.compile(r"Country\s+of\s+origin:\s*(?P<org>.+)", re.I))
 
 def _coty_num(s: str) -> float:
     if not s:
@@ -541,13 +1265,13 @@ def _coty_num(s: str) -> float:
 def _coty_qty(s: str) -> int:
     return int(s.replace("\u202f","").replace(" ","").replace(".","").replace(",","") or 0)
 
-def extract_coty(pdf_path: str, invoice_number: str) -> List[dict]:
-    rows: List[dict] = []
+def extract_coty(src: PDFSource, invoice_number: str) -> List[LineItem]:
+    rows: List[LineItem] = []
     LOOKAHEAD = 10  # líneas a mirar para HS/Origen después de detectar un ítem
 
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            lines = [ln.strip() for ln in (page.extract_text(x_tolerance=1.2) or "").split("\n") if ln.strip()]
+    with open_doc(src) as pdf:
+        for page in item_pages(pdf, "coty"):
+            lines = [ln.strip() for ln in page.extract_text(x_tolerance=1.2).split("\n") if ln.strip()]
             in_table = False
             i = 0
 
@@ -584,17 +1308,17 @@ def extract_coty(pdf_path: str, invoice_number: str) -> List[dict]:
                         if hs and org:
                             break
 
-                    rows.append({
-                        "Reference": gd["ref"],
-                        "Code EAN": gd["ean"],
-                        "Custom Code": hs,
-                        "Description": gd["desc"],
-                        "Origin": org,
-                        "Quantity": _coty_qty(gd["qty"]),
-                        "Unit Price": _coty_num(gd["unit"]),
-                        "Total Price": _coty_num(gd["total"]),
-                        "Invoice Number": invoice_number
-                    })
+                    rows.append(LineItem(
+                        ref=gd["ref"],
+                        ean=gd["ean"],
+                        custom=hs,
+                        desc=gd["desc"],
+                        origin=org,
+                        qty=_coty_qty(gd["qty"]),
+                        unit=_coty_num(gd["unit"]),
+                        total=_coty_num(gd["total"]),
+                        invoice=invoice_number
+                    ))
                     i += 1
                     continue
 
@@ -616,17 +1340,17 @@ def extract_coty(pdf_path: str, invoice_number: str) -> List[dict]:
                         if hs and org:
                             break
 
-                    rows.append({
-                        "Reference": gd["ref"],
-                        "Code EAN": gd["ean"],
-                        "Custom Code": hs,
-                        "Description": gd["desc"],
-                        "Origin": org,
-                        "Quantity": _coty_qty(mn.group("qty")),
-                        "Unit Price": _coty_num(mn.group("unit")),
-                        "Total Price": _coty_num(mn.group("total")),
-                        "Invoice Number": invoice_number
-                    })
+                    rows.append(LineItem(
+                        ref=gd["ref"],
+                        ean=gd["ean"],
+                        custom=hs,
+                        desc=gd["desc"],
+                        origin=org,
+                        qty=_coty_qty(mn.group("qty")),
+                        unit=_coty_num(mn.group("unit")),
+                        total=_coty_num(mn.group("total")),
+                        invoice=invoice_number
+                    ))
                     i += 2
                     continue
 
@@ -635,11 +1359,11 @@ def extract_coty(pdf_path: str, invoice_number: str) -> List[dict]:
 
     return rows
 # ─────────────────────  EXTRACTOR 6 (Bulgari ASN: Pos/Ref/Q.ty…)  ─────────────────────
-ASN_HEAD = re.compile(r"^\s*Pos\.\s*Reference\s*-\s*Cust\.\s*Material", re.I)
-ASN_END  = re.compile(r"^(SUBTOTAL|TOTAL)\s*:", re.I)
+ASN_HEAD = LinePattern("asn_head", re.compile(r"^\s*Pos\.\s*Reference\s*-\s*Cust\.\s*Material", re.I))
+ASN_END  = LinePattern("asn_end", re.compile(r"^(SUBTOTAL|TOTAL)\s*:", re.I))
 
 # Línea numérica (pos ref qty unit hs netw KG unit total)
-ASN_NUM = re.compile(
+ASN_NUM = LinePattern("asn_num", re.compile(
     r"""^\s*
     (?P<pos>\d{1,4})\s+
     (?P<ref>\d{3,})\s+
@@ -650,9 +1374,9 @@ ASN_NUM = re.compile(
     (?P<uprice>[\d\.,]+)\s+
     (?P<total>[\d\.,]+)(?:\*+)?\s*$
     """, re.X | re.I
-)
+))
 
-ASN_ORIGIN = re.compile(r"^Origin:\s*(?P<org>.+)$", re.I)
+ASN_ORIGIN = LinePattern("asn_origin", re.compile(r"^Origin:\s*(?P<org>.+)$", re.I))
 
 def _eu_to_float(s: str) -> float:
     if not s: return 0.0
@@ -669,17 +1393,17 @@ def _eu_to_float(s: str) -> float:
 def _to_int(s: str) -> int:
     return int(s.replace("\u202f","").replace(" ","").replace(".","").replace(",","") or 0)
 
-def extract_bulgari_asn(pdf_path: str, invoice_number: str) -> List[dict]:
+def extract_bulgari_asn(src: PDFSource, invoice_number: str) -> List[LineItem]:
     """
     Lee ítems en bloques de 3 líneas:
       1) numérica: pos ref qty unit hs netw KG unit total
       2) descripción (puede tener guiones)
       3) 'Origin: <pais>'
     """
-    rows: List[dict] = []
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            lines = [ln.strip() for ln in (page.extract_text(x_tolerance=1.2) or "").split("\n") if ln.strip()]
+    rows: List[LineItem] = []
+    with open_doc(src) as pdf:
+        for page in item_pages(pdf, "bulgari_asn"):
+            lines = [ln.strip() for ln in page.extract_text(x_tolerance=1.2).split("\n") if ln.strip()]
 
             in_table = False
             i = 0
@@ -722,26 +1446,26 @@ def extract_bulgari_asn(pdf_path: str, invoice_number: str) -> List[dict]:
                             step = (k - i + 1)
                             break
 
-                rows.append({
-                    "Reference": gd["ref"],
-                    "Code EAN": "",                # este layout no trae EAN
-                    "Custom Code": gd["hs"],
-                    "Description": desc,
-                    "Origin": org,
-                    "Quantity": _to_int(gd["qty"]),
-                    "Unit Price": _eu_to_float(gd["uprice"]),
-                    "Total Price": _eu_to_float(gd["total"]),
-                    "Invoice Number": invoice_number
-                })
+                rows.append(LineItem(
+                    ref=gd["ref"],
+                    ean="",                # este layout no trae EAN
+                    custom=gd["hs"],
+                    desc=desc,
+                    origin=org,
+                    qty=_to_int(gd["qty"]),
+                    unit=_eu_to_float(gd["uprice"]),
+                    total=_eu_to_float(gd["total"]),
+                    invoice=invoice_number
+                ))
 
                 i += step
     return rows
 # ─────────────────────  EXTRACTOR 7 (Interparfums USA: Order Confirmation)  ─────────────────────
-IPUSA_HEAD = re.compile(r"^\s*No\.\s*Description", re.I)
-IPUSA_END  = re.compile(r"^(Subtotal|Grand\s+Total|\$?\s*Grand\s+Total)", re.I)
+IPUSA_HEAD = LinePattern("ipusa_head", re.compile(r"^\s*No\.\s*Description", re.I))
+IPUSA_END  = LinePattern("ipusa_end", re.compile(r"^(Subtotal|Grand\s+Total|\$?\s*Grand\s+Total)", re.I))
 
 # Caso "una sola línea":   ref desc ... IT 3303.00.0000 720 720 Each 26.25 - 18,900.00
-IPUSA_ONE = re.compile(
+IPUSA_ONE = LinePattern("ipusa_one", re.compile(
     r"""^\s*
     (?P<ref>[A-Z0-9]{4,})\s+
     (?P<desc>.+?)\s+
@@ -754,11 +1478,11 @@ IPUSA_ONE = re.compile(
     (?P<posm>-|[\d\.,]+)\s+
     (?P<total>[\d\.,]+)\s*$
     """, re.X
-)
+))
 
 # Caso "dos líneas": 1) ref + desc (solo)   2) IT HS qty res uom unit posm total
-IPUSA_HEAD_ONLY = re.compile(r"^\s*(?P<ref>[A-Z0-9]{4,})\s+(?P<desc>.+?)\s*$")
-IPUSA_NUM_LINE  = re.compile(
+IPUSA_HEAD_ONLY = LinePattern("ipusa_head_only", re.compile(r"^\s*(?P<ref>[A-Z0-9]{4,})\s+(?P<desc>.+?)\s*$"))
+IPUSA_NUM_LINE  = LinePattern("ipusa_num_line", re.compile(
     r"""^\s*
     (?P<org>[A-Z]{2})\s+
     (?P<hs>\d{4}\.\d{2}\.\d{4}|\d{6,10})\s+
@@ -769,9 +1493,9 @@ IPUSA_NUM_LINE  = re.compile(
     (?P<posm>-|[\d\.,]+)\s+
     (?P<total>[\d\.,]+)\s*$
     """, re.X
-)
+))
 
-IPUSA_UPC = re.compile(r"^UPC\s*:\s*(?P<ean>\d{11,14})\s*$", re.I)
+IPUSA_UPC = LinePattern("ipusa_upc", re.compile(r"^UPC\s*:\s*(?P<ean>\d{11,14})\s*$", re.I))
 
 def _us_to_float(s: str) -> float:
     if not s: return 0.0
@@ -793,18 +1517,18 @@ def _us_to_float(s: str) -> float:
 def _to_int_clean(s: str) -> int:
     return int(s.replace("\u202f","").replace(" ","").replace(",","").replace(".","") or 0)
 
-def extract_ipusa_order_conf(pdf_path: str, invoice_number: str) -> List[dict]:
+def extract_ipusa_order_conf(src: PDFSource, invoice_number: str) -> List[LineItem]:
     """
     Interparfums USA - Order Confirmation (SO…):
       - Acepta una línea o dos líneas (desc multilínea).
       - Lee UPC en la/s línea/s siguiente/s ("UPC: 0857…") y lo usa como Code EAN.
     """
-    rows: List[dict] = []
+    rows: List[LineItem] = []
 
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
+    with open_doc(src) as pdf:
+        for page in item_pages(pdf, "ipusa"):
             # x_tolerance bajo para mantener el orden natural
-            lines = [ln.strip() for ln in (page.extract_text(x_tolerance=1.2) or "").split("\n") if ln.strip()]
+            lines = [ln.strip() for ln in page.extract_text(x_tolerance=1.2).split("\n") if ln.strip()]
 
             in_table = False
             i = 0
@@ -835,17 +1559,17 @@ def extract_ipusa_order_conf(pdf_path: str, invoice_number: str) -> List[dict]:
                             ean = mu.group("ean")
                             break
 
-                    rows.append({
-                        "Reference": gd["ref"],
-                        "Code EAN": ean,
-                        "Custom Code": gd["hs"].replace(".", ""),
-                        "Description": gd["desc"],
-                        "Origin": gd["org"],
-                        "Quantity": _to_int_clean(gd["qty"]),
-                        "Unit Price": _us_to_float(gd["unit"]),
-                        "Total Price": _us_to_float(gd["total"]),
-                        "Invoice Number": invoice_number
-                    })
+                    rows.append(LineItem(
+                        ref=gd["ref"],
+                        ean=ean,
+                        custom=gd["hs"].replace(".", ""),
+                        desc=gd["desc"],
+                        origin=gd["org"],
+                        qty=_to_int_clean(gd["qty"]),
+                        unit=_us_to_float(gd["unit"]),
+                        total=_us_to_float(gd["total"]),
+                        invoice=invoice_number
+                    ))
                     i += 1
                     continue
 
@@ -874,17 +1598,17 @@ def extract_ipusa_order_conf(pdf_path: str, invoice_number: str) -> List[dict]:
                                 ean = mu.group("ean")
                                 break
 
-                        rows.append({
-                            "Reference": ref,
-                            "Code EAN": ean,
-                            "Custom Code": gn["hs"].replace(".", ""),
-                            "Description": desc,
-                            "Origin": gn["org"],
-                            "Quantity": _to_int_clean(gn["qty"]),
-                            "Unit Price": _us_to_float(gn["unit"]),
-                            "Total Price": _us_to_float(gn["total"]),
-                            "Invoice Number": invoice_number
-                        })
+                        rows.append(LineItem(
+                            ref=ref,
+                            ean=ean,
+                            custom=gn["hs"].replace(".", ""),
+                            desc=desc,
+                            origin=gn["org"],
+                            qty=_to_int_clean(gn["qty"]),
+                            unit=_us_to_float(gn["unit"]),
+                            total=_us_to_float(gn["total"]),
+                            invoice=invoice_number
+                        ))
                         i = j + 1
                         continue
 
@@ -895,43 +1619,1116 @@ def extract_ipusa_order_conf(pdf_path: str, invoice_number: str) -> List[dict]:
 
 
 # ────────────────  COMPLEMENTO: llenar HTS / UPC faltantes  ────────────────
-def complete_missing_codes(pdf_path: str, rows: List[dict]) -> None:
-    """Rellena in-place cualquier fila sin HTS o UPC."""
-    lines=[]
-    with pdfplumber.open(pdf_path) as pdf:
-        for pg in pdf.pages:
-            txt=pg.extract_text(x_tolerance=1.5) or ""
-            lines.extend(txt.split("\n"))
-    lines=[re.sub(r"\s{2,}"," ",ln.strip()) for ln in lines if ln.strip()]
-
-    # mapa Reference → índice aproximado (solo layouts con país abreviado)
-    ref_idx={}
-    for idx,ln in enumerate(lines):
-        m=re.match(r"^([A-Z0-9]{3,})\s+[A-Z]{3}\s",ln)
-        if m:
-            ref_idx.setdefault(m.group(1), idx)
+_CODE_HEAD = LinePattern("code_head", re.compile(r"^([A-Z0-9]{3,})\s+[A-Z]{3}\s"))
+_DIGIT_RUN = re.compile(r"\d{6,14}")
+_MULTI_WS  = re.compile(r"\s{2,}")
+CODE_BLOCK_MAX = 20   # líneas máximas de un bloque de ítem
+
+def build_code_index(src: PDFSource) -> Dict[str, Tuple[int, int, str, str]]:
+    """
+    Una sola pasada sobre el texto (x_tolerance=1.5): Reference → (inicio, fin,
+    primer HTS, primer UPC) de su bloque. El bloque va desde la línea cabecera
+    hasta la siguiente cabecera (máx. CODE_BLOCK_MAX líneas); como los bloques
+    no se solapan, cada línea se clasifica con HTS_PAT/UPC_PAT a lo sumo una vez.
+    """
+    with open_doc(src) as pdf:
+        lines=[_MULTI_WS.sub(" ", ln.strip())
+               for pg in pdf.iter_pages() for ln in pg.extract_text(x_tolerance=1.5).split("\n")
+               if ln.strip()]
+
+    heads=[(i, m.group(1)) for i, ln in enumerate(lines) if (m := _CODE_HEAD.match(ln))]
+    index: Dict[str, Tuple[int, int, str, str]] = {}
+    for k, (start, ref) in enumerate(heads):
+        if ref in index:          # vale la primera aparición
+            continue
+        nxt = heads[k+1][0] if k+1 < len(heads) else len(lines)
+        end = min(nxt, start + CODE_BLOCK_MAX)
+        hts = upc = ""
+        for ln in lines[start:end]:
+            for seq in _DIGIT_RUN.findall(ln):
+                if not hts and HTS_PAT.match(seq):
+                    hts = seq
+                elif not upc and UPC_PAT.match(seq):
+                    upc = seq
+            if hts and upc:
+                break
+        index[ref] = (start, end, hts, upc)
+    return index
+
+def complete_missing_codes(src: PDFSource, rows: List[LineItem]) -> None:
+    """Rellena in-place cualquier fila sin HTS o UPC (un lookup por fila)."""
+    if all(r.custom and r.ean for r in rows):
+        return   # nada que rellenar: ni siquiera se extrae el texto a 1.5
 
+    index = build_code_index(src)
     for r in rows:
-        if r["Custom Code"] and r["Code EAN"]:
+        if r.custom and r.ean:
             continue
-        start=ref_idx.get(r["Reference"])
-        if start is None:
+        hit = index.get(r.ref)
+        if hit is None:
             continue
-        end=start+1
-        while end<len(lines) and end-start<20:
-            if re.match(r"^[A-Z0-9]{3,}\s+[A-Z]{3}\s",lines[end]):
-                break
-            end+=1
-        snippet=" ".join(lines[start:end])
-        seqs=re.findall(r"\d{6,14}", snippet)
-        hts=[s for s in seqs if HTS_PAT.match(s)]
-        upc=[s for s in seqs if UPC_PAT.match(s)]
-        if hts and not r["Custom Code"]:
-            r["Custom Code"]=hts[0]
-        if upc and not r["Code EAN"]:
-            r["Code EAN"]=upc[0]
+        _, _, hts, upc = hit
+        if hts and not r.custom:
+            r.custom=hts
+        if upc and not r.ean:
+            r.ean=upc
+
+# ─────────────────────  REGISTRO DE EXTRACTORES  ─────────────────────
+# cabeceras para los fingerprints
+def _is_no_desc(ln: str) -> bool:
+    return "No. Description" in ln
+
+def _original_header(ln: str) -> bool:
+    return bool(ORG_PAT.search(ln) or ORDER_NR_PAT.search(ln) or PLV_PAT.search(ln))
+
+class Extractor:
+    """
+    Estrategia de extracción; se registra sola en EXTRACTORS (clave = layout).
+      fn(doc, inv) → filas
+      tolerances   x_tolerance que lee de cada página (prefetch y release en
+                   baja memoria); lo que solo mira la cabecera no cuenta
+      fingerprint  (x_tolerance, cabecera(ln) → bool, patrones de fila | None)
+                   para classify_layout; None = solo entra en el barrido
+      coords       usa filas por coordenadas (ParsedPage.coord_rows)
+      cost         coste relativo por página: orden del barrido (más barato primero)
+      priority     desempate en classify_layout y en el barrido (menor gana)
+    Agregar un proveedor = escribir su extract_* y registrar un Extractor.
+    """
+    __slots__ = ("name", "fn", "tolerances", "fingerprint", "coords", "cost", "priority")
+
+    def __init__(self, name: str, fn: Callable[[ParsedPDF, str], List[LineItem]],
+                 tolerances: Tuple[Optional[float], ...] = (None,),
+                 fingerprint: Optional[tuple] = None, coords: bool = False,
+                 cost: float = 1.0, priority: int = 100):
+        self.name, self.fn, self.tolerances = name, fn, tolerances
+        self.fingerprint, self.coords = fingerprint, coords
+        self.cost, self.priority = cost, priority
+        EXTRACTORS[name] = self
+
+    @property
+    def enabled(self) -> bool:
+        return (not EXTRACTORS_ON or self.name in EXTRACTORS_ON) and self.name not in EXTRACTORS_OFF
+
+    def __call__(self, doc: ParsedPDF, inv_num: str) -> List[LineItem]:
+        return self.fn(doc, inv_num)
+
+    def __repr__(self) -> str:
+        return f"Extractor({self.name!r}, cost={self.cost}, priority={self.priority})"
+
+EXTRACTORS: Dict[str, Extractor] = {}
+
+def active_extractors(by_cost: bool = False) -> List[Extractor]:
+    """Extractores habilitados en este despliegue, por prioridad o por (coste, prioridad)."""
+    key = (lambda e: (e.cost, e.priority)) if by_cost else (lambda e: e.priority)
+    return sorted((e for e in EXTRACTORS.values() if e.enabled), key=key)
+
+def extractor_config() -> str:
+    """Extractores activos + SWEEP_CLAIM: cambian las filas, van en la clave de caché."""
+    return ",".join(e.name for e in active_extractors()) + f"|{SWEEP_CLAIM:g}"
+
+# Coste: 1 = regex por línea sobre el texto por defecto (compartido con
+# classify/invoice); +1 si lee otra x_tolerance (1.2, compartida entre los
+# tres); original suma doc_kind/ORG sobre todo el texto; lvmh analiza chars.
+Extractor("coty", extract_coty, (1.2,),
+          (1.2, _COTY_TABLE_HDR.match, (_COTY_ONE_LINE, _COTY_HEAD_ONLY)), cost=2, priority=10)
+Extractor("bulgari_asn", extract_bulgari_asn, (1.2,),
+          (1.2, ASN_HEAD.search, (ASN_NUM,)), cost=2, priority=20)
+Extractor("ipusa", extract_ipusa_order_conf, (1.2,),
+          (1.2, IPUSA_HEAD.match, (IPUSA_ONE, IPUSA_NUM_LINE)), cost=2, priority=30)
+Extractor("new_provider", extract_new_provider, (None,),
+          (None, _is_no_desc, (pattern_full, pattern_nohs, pattern_basic)), cost=1, priority=40)
+Extractor("interparfums", extract_interparfums_blocks, (None,),
+          (None, HS_ORG_PAT.search, (HEAD_INLINE_PAT,)), cost=1, priority=50)
+Extractor("original", lambda doc, inv: extract_original(doc), (None,),
+          (None, _original_header, None), cost=1.5, priority=60)     # filas según doc_kind()
+Extractor("lvmh", extract_slice, (),      # filas por coordenadas; texto solo de la cabecera
+          (None, _is_no_desc, None), coords=True, cost=4, priority=70)
+
+# un nombre mal escrito en la lista blanca apagaría todos los extractores
+# ("Sin registros extraídos" en cada subida): se rechaza al importar
+for _env, _names in (("CONVERT_EXTRACTORS", EXTRACTORS_ON), ("CONVERT_EXTRACTORS_OFF", EXTRACTORS_OFF)):
+    if _unknown := _names - EXTRACTORS.keys():
+        raise ValueError(f"{_env}: extractores desconocidos {', '.join(sorted(_unknown))} "
+                         f"(válidos: {', '.join(EXTRACTORS)})")
+del _env, _names, _unknown
+
+# ─────────────────────  CLASIFICADOR DE LAYOUT (huella rápida)  ─────────────────────
+# Cada layout se reconoce por un marcador de cabecera y/o una fila de ítem
+# reconocible en las primeras páginas (Extractor.fingerprint); en caso de
+# empate gana el de menor Extractor.priority.
+LAYOUT_MIN_CONFIDENCE = 0.8
+LAYOUT_SCAN_PAGES     = 3     # páginas a mirar si la 1ª no basta (portadas, T&C)
+
+def _layout_rows_hit(ex: Extractor, row_pats, page: ParsedPage, lines: List[str]) -> bool:
+    if ex.coords:
+        return bool(page.coord_rows())
+    if ex.name == "original":
+        if doc_kind(page.extract_text()) == "factura":
+            row_pats = (ROW_FACT,)
+        else:
+            row_pats = (ROW_PROF_DIOR, ROW_PROF)
+    return any(p.match(ln) for ln in lines for p in row_pats)
+
+def classify_layout(doc: ParsedPDF) -> Tuple[str, float]:
+    """
+    Identifica el layout del proveedor a partir del texto de la(s) primera(s)
+    página(s), solo entre los extractores activos con fingerprint.
+    Confianza: 1.0 cabecera + fila, 0.8 solo fila, 0.6 solo cabecera.
+    Devuelve ("unknown", 0.0) si ningún marcador aparece.
+    """
+    candidates = [e for e in active_extractors() if e.fingerprint]
+    header = {e.name: False for e in candidates}
+    row    = dict(header)
+
+    for page in doc.iter_pages(doc.pages[:LAYOUT_SCAN_PAGES]):
+        lines_by_tol = {}
+        for ex in candidates:
+            layout, (tol, head_fn, row_pats) = ex.name, ex.fingerprint
+            if tol not in lines_by_tol:
+                lines_by_tol[tol] = [ln.strip() for ln in page.extract_text(tol).split("\n") if ln.strip()]
+            lines = lines_by_tol[tol]
+            if not header[layout]:
+                header[layout] = any(head_fn(ln) for ln in lines)
+            # la fila por coordenadas solo se prueba si hay cabecera (es la más cara)
+            if not row[layout] and (not ex.coords or header[layout]):
+                row[layout] = _layout_rows_hit(ex, row_pats, page, lines)
+        if any(header[l] and row[l] for l in header):
+            break
+
+    best, best_conf = "unknown", 0.0
+    for layout in header:
+        conf = 1.0 if header[layout] and row[layout] else 0.8 if row[layout] else 0.6 if header[layout] else 0.0
+        if conf > best_conf:
+            best, best_conf = layout, conf
+    return best, best_conf
+
+# ─────────────────────  MERGE DE FILAS (la mejor fila por ítem)  ─────────────────────
+def totals_match(r: LineItem) -> bool:
+    """qty × unit cuadra con el total (1 % o un centavo)."""
+    return bool(r.qty and r.unit) and abs(r.qty * r.unit - r.total) <= max(0.01, 0.01 * abs(r.total))
+
+def row_score(r: LineItem) -> int:
+    """Completitud + coherencia de una fila: a mayor puntaje, mejor candidata."""
+    score = sum(1 for v in (r.ref, r.ean, r.custom, r.desc, r.origin) if v)
+    score += (r.qty > 0) + (r.unit > 0) + (r.total > 0)
+    score += bool(r.ean and UPC_PAT.match(r.ean)) + bool(r.custom and HTS_PAT.match(r.custom))
+    if totals_match(r):
+        score += 2
+    return score
+
+class _MergeEntry:
+    __slots__ = ("row", "score", "sources", "source")
+
+    def __init__(self, row: LineItem, score: int, source: str):
+        self.row, self.score, self.source = row, score, source
+        self.sources = {source}
+
+class RowMerger:
+    """
+    Junta las filas de uno o varios extractores a medida que llegan, con un
+    índice por invoice → Reference. Una fila nueva se une a una ya vista si:
+      • tiene el mismo EAN (la misma clave que el dedup anterior), o
+      • viene de otro extractor que todavía no aportó a esa entrada
+        (mismo ítem leído por otra estrategia, aunque el EAN difiera).
+    Gana la de mayor row_score (empate: la primera) y hereda los campos
+    vacíos de la otra. El orden de salida es el de primera aparición.
+    """
+
+    def __init__(self):
+        self._index: Dict[str, Dict[str, List[_MergeEntry]]] = {}
+        self._entries: List[_MergeEntry] = []
+        self.seen: Dict[str, int] = {}       # filas recibidas por extractor
+        self.replaced = 0
+
+    def add(self, rows: List[LineItem], source: str) -> None:
+        self.seen[source] = self.seen.get(source, 0) + len(rows)
+        for r in rows:
+            same_ref = self._index.setdefault(r.invoice, {}).setdefault(r.ref, [])
+            hit = next((e for e in same_ref if e.row.ean == r.ean), None)
+            if hit is None:
+                hit = next((e for e in same_ref if source not in e.sources), None)
+            score = row_score(r)
+            if hit is None:
+                e = _MergeEntry(r, score, source)
+                same_ref.append(e)
+                self._entries.append(e)
+                continue
+            hit.sources.add(source)
+            if score > hit.score:
+                loser = hit.row
+                hit.row, hit.source = r, source
+                self.replaced += 1
+            else:
+                loser = r
+            if self._fill(hit.row, loser):
+                score = row_score(hit.row)
+            hit.score = max(hit.score, score)
+
+    @staticmethod
+    def _fill(win: LineItem, other: LineItem) -> bool:
+        changed = False
+        for f in ("ean", "custom", "desc", "origin"):
+            if not getattr(win, f) and getattr(other, f):
+                setattr(win, f, getattr(other, f))
+                changed = True
+        return changed
+
+    @property
+    def rows(self) -> List[LineItem]:
+        return [e.row for e in self._entries]
+
+    def count_into(self, timer: StageTimer) -> None:
+        """merge.in.<extractor> (filas recibidas) y merge.kept.<extractor> (ganadoras)."""
+        for src, n in self.seen.items():
+            timer.count(f"merge.in.{src}", n)
+        for e in self._entries:
+            timer.count(f"merge.kept.{e.source}")
+        timer.count("merge.replaced", self.replaced)
+
+SWEEP_CLAIM_MIN_ROWS = 3   # con menos filas ningún extractor reclama el documento
+
+def claim_confidence(rows: List[LineItem]) -> float:
+    """
+    Fracción de filas con qty × unit = total leído del PDF. Las filas con
+    total derivado cuadran siempre y no cuentan como evidencia; con menos
+    de SWEEP_CLAIM_MIN_ROWS filas con total leído no se reclama (0).
+    """
+    read = [r for r in rows if not r.derived]
+    if len(read) < SWEEP_CLAIM_MIN_ROWS:
+        return 0.0
+    return sum(map(totals_match, read)) / len(rows)
+
+def extract_all(doc: ParsedPDF, inv_num: str,
+                timer: Optional[StageTimer] = None,
+                merger: Optional[RowMerger] = None,
+                skip: Tuple[str, ...] = (),
+                claim: float = SWEEP_CLAIM) -> List[LineItem]:
+    """
+    Barrido para layout desconocido: los extractores activos (menos `skip`,
+    ya corridos) del más barato al más caro, unidos con RowMerger. Para en
+    cuanto uno reclama el documento (claim_confidence ≥ claim).
+    """
+    timer = timer or StageTimer()
+    merger = merger if merger is not None else RowMerger()
+    for i, ex in enumerate(active_extractors(by_cost=True), 1):
+        if ex.name in skip:
+            continue
+        with timer.stage(f"extract_{ex.name}"):
+            rows = ex(doc, inv_num)
+        logging.info("r%d %s=%d", i, ex.name, len(rows))
+        with timer.stage("dedup"):
+            merger.add(rows, ex.name)
+        if (conf := claim_confidence(rows)) >= claim:
+            logging.info("barrido: %s reclama el documento (%.2f)", ex.name, conf)
+            timer.count(f"sweep.claimed.{ex.name}")
+            break
+    return merger.rows
+
+# ─────────────────────  CONCILIACIÓN: totales del pie vs. filas  ─────────────────────
+# Líneas de totales del pie ("Total before…", SUBTOTAL, Grand Total y las que
+# cortan la tabla en COTY/ASN). De cada una se toman los números: con 1-2
+# decimales = importe; enteros = cantidad o importe redondo. Solo se usa el
+# texto ya cacheado por página: el PDF no se vuelve a analizar.
+# sin \b tras la etiqueta: las líneas armadas desde chars pueden venir sin
+# blancos ("Totalbeforetax94184.21")
+FOOTER_PAT  = re.compile(
+    r"^\W*(?P<label>grand\s*total|sub\s*-?\s*total|total(?:\s*before)?|carry\s*forward)(?P<rest>.*)$",
+    re.I)
+# respaldo sobre el flujo de chars del pre-filtro (sin cortes de línea):
+# etiqueta + hasta 30 no-dígitos + un número
+FOOTER_SCREEN_PAT = re.compile(
+    r"(?:GRAND\s*TOTAL|SUB\s*-?\s*TOTAL|TOTAL(?:\s*BEFORE)?|CARRY\s*FORWARD)(?P<rest>[^\d\n]{0,30}\d[\d.,\u202f]*)")
+FOOTER_SKIP = re.compile(r"\b(?:KGS?|WEIGHT|POIDS|PESO|CBM|M3|VOLUME|PALLETS?|CARTONS?|COLIS)\b", re.I)
+FOOTER_QTY  = re.compile(r"\b(?:QTY|QUANTITY|QUANTIT[EÉ]|CANTIDAD|PCS|PIECES|UNITS|PZ|EACH)\b", re.I)
+_FOOTER_NUM = re.compile(r"\d[\d.,\u202f]*")
+_FOOTER_DEC = re.compile(r"(.*)[.,](\d{1,2})")
+_NUM_SEPS   = re.compile(r"[.,\u202f]")
+RECON_MAX_ROWS = 200   # filas con qty × unit ≠ total que se detallan por archivo
+
+def _footer_numbers(rest: str) -> Tuple[List[int], List[float]]:
+    """(enteros, importes) de una línea de totales; los enteros cuentan en ambos."""
+    ints, amounts = [], []
+    for tok in _FOOTER_NUM.findall(rest):
+        tok = tok.rstrip(".,")
+        if m := _FOOTER_DEC.fullmatch(tok):
+            amounts.append(float(f"{_NUM_SEPS.sub('', m.group(1)) or 0}.{m.group(2)}"))
+        else:
+            n = int(_NUM_SEPS.sub("", tok))
+            ints.append(n)
+            amounts.append(float(n))
+    return ints, amounts
+
+def footer_totals(doc: ParsedPDF) -> Tuple[List[Tuple[int, str]], List[Tuple[float, str]], bool, int]:
+    """
+    (cantidades, importes, hay línea de cantidad, páginas sin leer) del pie,
+    cada número con la etiqueta de su línea. Por página usa lo que ya esté
+    en caché: el texto extraído; si no hay, las líneas de totales que vio
+    coord_rows (LVMH); si tampoco, el flujo de chars del pre-filtro (páginas
+    descartadas). Una página que no pasó por ninguno cuenta como sin leer.
+    """
+    qtys, amounts, qty_line, unread = [], [], False, 0
+    for page in doc.pages:
+        txt = page.cached_text()
+        if txt is not None:
+            found = [(m.group("rest"), ln) for ln in txt.split("\n") if (m := FOOTER_PAT.match(ln))]
+        elif page._footer is not None:
+            found = [(FOOTER_PAT.match(ln).group("rest"), ln) for ln in page._footer]
+        elif page._screen is not None:
+            found = [(m.group("rest"), m.group(0)) for m in FOOTER_SCREEN_PAT.finditer(page._screen[1])]
+        else:
+            unread += 1
+            continue
+        for rest, ln in found:
+            if FOOTER_SKIP.search(ln):
+                continue
+            ints, amts = _footer_numbers(rest)
+            label = ln.strip()[:60]
+            qtys += [(n, label) for n in ints]
+            amounts += [(a, label) for a in amts]
+            qty_line = qty_line or bool(ints and FOOTER_QTY.search(ln))
+    return qtys, amounts, qty_line, unread
+
+def _footer_check(cands: list, extracted: float, tol: float, strict: bool) -> Dict:
+    """Compara una suma con el número más cercano del pie."""
+    out = {"extracted": extracted, "footer": None, "label": "", "status": "no_footer"}
+    if not cands:
+        return out
+    value, label = min(cands, key=lambda c: abs(c[0] - extracted))
+    if abs(value - extracted) <= tol:
+        out.update(footer=value, label=label, status="ok")
+    elif strict:
+        out.update(footer=value, label=label, status="mismatch")
+    return out
+
+def reconcile(doc: ParsedPDF, rows: List[LineItem]) -> Dict:
+    """
+    Valida la extracción sin releer el PDF: por invoice, suma de Total Price
+    y de Quantity contra los totales del pie (ok si alguno cuadra: el pie
+    puede traer subtotales, totales con y sin impuestos…), y por fila
+    qty × unit = total (las filas sin total, p.ej. FOC, no se chequean).
+    Quantity solo es "mismatch" si el pie tiene una línea de cantidad.
+    status: ok | mismatch | no_footer | no_rows.
+    """
+    qtys, amounts, qty_line, unread = footer_totals(doc)
+    by_inv: Dict[str, List[LineItem]] = {}
+    for r in rows:
+        by_inv.setdefault(r.invoice, []).append(r)
+
+    invoices = []
+    for inv, items in by_inv.items():
+        total = round(sum(r.total for r in items), 2)
+        qty = sum(r.qty for r in items)
+        checks = {
+            "total":    _footer_check(amounts, total, max(0.05, 0.001 * abs(total)), strict=True),
+            "quantity": _footer_check(qtys, qty, 0, strict=qty_line),
+        }
+        states = {c["status"] for c in checks.values()}
+        status = "mismatch" if "mismatch" in states else "ok" if "ok" in states else "no_footer"
+        invoices.append({"invoice": inv, "rows": len(items), "status": status, **checks})
+
+    bad = [r for r in rows if r.total and r.unit and r.qty and not totals_match(r)]
+    states = {i["status"] for i in invoices}
+    status = ("no_rows" if not rows else "mismatch" if bad or "mismatch" in states
+              else "ok" if "ok" in states else "no_footer")
+    return {
+        "status": status,
+        "invoices": invoices,
+        "footer_numbers": len(amounts),
+        "pages_unread": unread,
+        "row_mismatches": len(bad),
+        "rows": [{"ref": r.ref, "invoice": r.invoice, "qty": r.qty, "unit": r.unit,
+                  "total": r.total, "expected": round(r.qty * r.unit, 2)}
+                 for r in bad[:RECON_MAX_ROWS]],
+    }
+
+# ─────────────────────  CACHÉ DE RESULTADOS (sha256 del PDF)  ─────────────────────
+def _extractor_fingerprint() -> str:
+    """Huella del código de extracción: cualquier cambio invalida la caché."""
+    with open(__file__, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+EXTRACTOR_VERSION = _extractor_fingerprint()
+
+def source_sha256(src) -> str:
+    """sha256 de una ruta, bytes o stream (el stream vuelve a su posición)."""
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(src).hexdigest()
+    h = hashlib.sha256()
+    if isinstance(src, str):
+        with open(src, "rb") as f:
+            while data := f.read(1024 * 1024):
+                h.update(data)
+        return h.hexdigest()
+    pos = src.tell()
+    src.seek(0)
+    while data := src.read(1024 * 1024):
+        h.update(data)
+    src.seek(pos)
+    return h.hexdigest()
+
+def portable_source(src):
+    """Ruta o bytes que se pueden mandar a otro proceso (los streams se leen)."""
+    if isinstance(src, (str, bytes)):
+        return src
+    if isinstance(src, (bytearray, memoryview)):
+        return bytes(src)
+    pos = src.tell()
+    src.seek(0)
+    data = src.read()
+    src.seek(pos)
+    return data
+
+def evict_oldest(root: str, max_bytes: int, suffixes: Tuple[str, ...]) -> None:
+    """Borra los archivos `suffixes` de root, más antiguos primero, hasta quedar en max_bytes."""
+    entries = []
+    for name in os.listdir(root):
+        if not name.endswith(suffixes):
+            continue
+        try:
+            st = os.stat(os.path.join(root, name))
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, name))
+    total = sum(e[1] for e in entries)
+    for _, size, name in sorted(entries):   # más antiguos primero
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(os.path.join(root, name))
+        except OSError:
+            pass
+        total -= size
+
+class DiskResultCache:
+    """
+    Caché LRU en disco de (filas, layout, conciliación) por PDF, con tope de tamaño total.
+    Un JSON por entrada; el mtime marca el último uso. Se comparte entre
+    procesos del pool (escrituras atómicas con os.replace).
+    """
+
+    def __init__(self, root: str = CACHE_DIR, max_mb: int = CACHE_MAX_MB):
+        self.root = root
+        self.max_bytes = max_mb * 1024 * 1024
+        if self.enabled:
+            os.makedirs(root, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(digest: str, inv_hint: str) -> str:
+        # inv_hint = invoice sacado del nombre (SIP…), cambia las filas
+        # los extractores activos también (configuración del despliegue)
+        return hashlib.sha256(f"{digest}:{EXTRACTOR_VERSION}:{extractor_config()}:{inv_hint}"
+                              .encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key + ".json")
+
+    def get(self, key: str) -> Optional[Tuple[List[LineItem], str, Optional[Dict]]]:
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            os.utime(path)   # marca como usado recientemente
+        except (OSError, ValueError):
+            return None
+        return [LineItem(*v) for v in data["rows"]], data["layout"], data.get("recon")
+
+    def put(self, key: str, rows: List[LineItem], layout: str, recon: Optional[Dict] = None) -> None:
+        if not self.enabled:
+            return
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                # filas como listas (as_row + order_nr): sin repetir claves por fila
+                json.dump({"rows": [[*r.as_row(), r.order_nr] for r in rows], "layout": layout,
+                           "recon": recon}, f, ensure_ascii=False)
+            os.replace(tmp, path)
+            self._evict()
+        except OSError:
+            logging.warning("No se pudo guardar en caché %s", path, exc_info=True)
+
+    def _evict(self) -> None:
+        evict_oldest(self.root, self.max_bytes, (".json",))
+
+result_cache = DiskResultCache()
+
+# ─────────────────────  PIPELINE POR ARCHIVO  ─────────────────────
+class FileResult(NamedTuple):
+    rows: List[LineItem]
+    layout: str          # "layout:confianza"
+    stats: dict          # StageTimer.to_dict()
+    recon: Optional[dict] = None   # reconcile(): totales del pie vs. filas
+
+
+def process_pdf(src, filename: str, page_workers: int = 1) -> FileResult:
+    """
+    Pipeline completo de un PDF (ruta, bytes o stream en memoria):
+    layout → invoice → extracción → merge (RowMerger) → códigos → conciliación.
+    Con CONVERT_RE_STATS=1 los stats incluyen hits/misses por LinePattern ("re.<nombre>.*").
+    Con page_workers > 1 el análisis de layout de un PDF grande se reparte por
+    rangos de páginas (ver prefetch_pages). Devuelve filas, "layout:confianza",
+    los tiempos por etapa y la conciliación (reconcile). Los resultados se
+    guardan en result_cache por sha256 del PDF.
+    """
+    timer = StageTimer()
+    # 1) intenta desde el nombre (SIP…), 2) si no, desde el PDF (Invoice No.)
+    inv_num=(m.group(1) if (m:=_SIP_FILE_PAT.search(filename or "")) else "")
+
+    cache_key = None
+    if result_cache.enabled:
+        with timer.stage("cache"):
+            cache_key = result_cache.key(source_sha256(src), inv_num)
+            hit = result_cache.get(cache_key)
+        if hit is not None:
+            logging.info("Caché %s (%d filas)", filename, len(hit[0]))
+            timer.count("cache_hits")
+            timer.count("rows", len(hit[0]))
+            rows, layout, recon = hit
+            return FileResult(rows, layout, timer.to_dict(), recon)
+
+    # contadores de LinePattern: se reporta el delta de este archivo
+    # (aproximado si otros hilos del proceso extraen a la vez, p.ej. jobs)
+    re_before = line_pattern_counts()
+
+    # un solo open: todas las estrategias comparten chars/texto cacheados
+    with timer.stage("open"):
+        doc = ParsedPDF(src)
+    with doc:
+        # layout reconocido → un solo extractor; si no, barrido del más barato al más caro
+        doc.plan(active_extractors())
+        with timer.stage("classify"):
+            layout, conf = classify_layout(doc)
+        logging.info("layout=%s conf=%.2f", layout, conf)
+        dispatch = conf >= LAYOUT_MIN_CONFIDENCE
+        todo = [EXTRACTORS[layout]] if dispatch else active_extractors()
+        doc.plan(todo)
+
+        if page_workers > 1 and len(doc.pages) >= PAGE_SHARD_MIN_PAGES:
+            with timer.stage("prefetch"):
+                prefetch_pages(doc, src, doc.keep_tols, coords=bool(doc.keep_coords),
+                               workers=page_workers)
+
+        if not inv_num:
+            with timer.stage("invoice"):
+                inv_num = parse_invoice_number_from_pdf(doc)
+        doc.plan(todo, invoice=False)
+
+        logging.info("Procesando %s (inv=%s)", filename, inv_num)
+
+        # las filas entran al merge según salen de cada extractor (sin lista combo)
+        merger = RowMerger()
+        if dispatch:
+            with timer.stage(f"extract_{layout}"):
+                rows = EXTRACTORS[layout](doc, inv_num)
+            logging.info("%s=%d", layout, len(rows))
+            with timer.stage("dedup"):
+                merger.add(rows, layout)
+            del rows
+        if not merger.seen.get(layout):
+            # el extractor del layout ya corrió sin filas: el barrido no lo repite
+            extract_all(doc, inv_num, timer, merger, skip=(layout,) if dispatch else ())
+            layout = "sweep"
+        uniq = merger.rows
+        merger.count_into(timer)
+
+        # rellenar cualquier HTS / UPC faltante
+        with timer.stage("complete_codes"):
+            complete_missing_codes(doc, uniq)
+
+        # totales del pie vs. filas, con el texto ya cacheado
+        with timer.stage("reconcile"):
+            recon = reconcile(doc, uniq)
+        timer.count(f"recon.{recon['status']}")
+
+        timer.add("text", doc.stats.get("text_s", 0.0))
+        timer.count("pages", len(doc.pages))
+        timer.count("chars", int(doc.stats.get("chars", 0)))
+        timer.count("pages_skipped", int(doc.stats.get("pages_skipped", 0)))
+        timer.count("col_template_hits", int(doc.stats.get("col_template_hits", 0)))
+        timer.count("pages_released", int(doc.stats.get("pages_released", 0)))
+        timer.count("rows", len(uniq))
+        for k, n in line_pattern_counts().items():
+            if n > re_before[k]:
+                timer.count(k, n - re_before[k])
+
+    layout_conf = f"{layout}:{conf:.2f}"
+    if cache_key:
+        result_cache.put(cache_key, uniq, layout_conf, recon)
+    return FileResult(uniq, layout_conf, timer.to_dict(), recon)
+
+def _shard_pages(job) -> List[Tuple[Dict[Optional[float], str], Optional[list], Tuple[int, str]]]:
+    """Worker: texto por tolerancia (+ filas por coordenadas y pre-filtro) de un rango de páginas."""
+    src, start, end, tols, coords = job
+    out = []
+    with ParsedPDF(src) as doc:
+        for page in doc.iter_pages(doc.pages[start:end]):
+            texts = {t: page.extract_text(t) for t in tols}
+            out.append((texts, page.coord_rows() if coords else None, page.screen()))
+    return out
+
+def prefetch_pages(doc: ParsedPDF, src, tols, coords: bool, workers: int) -> None:
+    """
+    Reparte las páginas aún no analizadas en rangos contiguos entre procesos
+    y siembra la caché de cada ParsedPage. Solo se paraleliza el análisis de
+    layout (independiente por página); los bucles de líneas con estado
+    (org_global, in_table, …) corren luego en orden sobre la caché, así que
+    el estado cruza los bordes de rango igual que en modo secuencial.
+    """
+    tols = tuple(tols)
+    todo = [i for i, p in enumerate(doc.pages)
+            if any(t not in p._text for t in tols) or (coords and p._coord_rows is None)]
+    if not todo:
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    src = portable_source(src)   # cada worker reabre el PDF por su cuenta
+    first = todo[0]
+    n = len(doc.pages) - first
+    size = max(1, -(-n // (workers * 2)))   # ~2 rangos por worker
+    jobs = [(src, a, min(a + size, len(doc.pages)), tols, coords)
+            for a in range(first, len(doc.pages), size)]
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        for (_, a, _, _, _), shard in zip(jobs, ex.map(_shard_pages, jobs)):
+            for k, (texts, crow, screen) in enumerate(shard):
+                doc.pages[a + k].prime(texts, crow, screen)
+
+def _init_worker(mem_mb: int) -> None:
+    """Límite de memoria (address space) por proceso hijo."""
+    if mem_mb > 0:
+        import resource
+        lim = mem_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (lim, lim))
+
+def _process_pdf_job(job) -> FileResult:
+    return process_pdf(*job)
+
+def bounded_map(ex, fn: Callable, items: Iterable, window: int) -> Iterator:
+    """
+    Como ex.map, en orden, pero con a lo sumo `window` tareas enviadas a la
+    vez: `items` se consume a medida que avanza (ex.map lo lee y envía todo
+    de entrada). Si el consumidor corta, las pendientes se cancelan.
+    """
+    pending = deque()
+    try:
+        for item in items:
+            if len(pending) >= window:
+                yield pending.popleft().result()
+            pending.append(ex.submit(fn, item))
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for fut in pending:
+            fut.cancel()
+
+def run_pipelines(jobs: List[Tuple[PDFSource, str]],
+                  workers: int = WORKERS,
+                  mem_mb: int = WORKER_MEM_MB,
+                  page_workers: int = PAGE_WORKERS) -> Iterator[FileResult]:
+    """
+    Procesa [(fuente, nombre), …] y va entregando los resultados en el MISMO
+    orden de subida (el workbook queda determinista aunque se use el pool).
+    Es un generador: cada archivo se puede escribir y soltar al terminar.
+    """
+    workers = min(workers, len(jobs))
+    if workers <= 1:
+        for src, name in jobs:
+            yield process_pdf(src, name, page_workers)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_worker,
+                             initargs=(mem_mb,)) as ex:
+        # los streams no cruzan procesos: se mandan como bytes, y solo los de
+        # ~2 archivos por worker a la vez (no todo el lote en memoria)
+        yield from bounded_map(ex, _process_pdf_job,
+                               ((portable_source(src), name) for src, name in jobs),
+                               window=2 * workers)
+
+# ─────────────────────  SALIDA: XLSX / CSV / Parquet (en streaming)  ─────────────────────
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+RECON_COLS = ["File", "Invoice", "Check", "Status", "Extracted", "Footer", "Detail"]
+
+class XlsxRowWriter:
+    """
+    Workbook en modo write-only: cada fila se serializa a disco al agregarla,
+    así la memoria no crece con el número de filas (ni celdas openpyxl).
+    """
+    ext = "xlsx"
+    mimetype = XLSX_MIME
+
+    def __init__(self):
+        from openpyxl import Workbook
+        self.wb = Workbook(write_only=True)
+        self.ws = self.wb.create_sheet("Sheet")
+        self.ws.append(COLS)
+        self.recon_ws = None   # hoja "Conciliación", al primer write_recon
+        self.count = 0
+        self.saved = False
+
+    def write(self, rows: List[LineItem]) -> None:
+        for r in rows:
+            self.ws.append(r.as_row())
+        self.count += len(rows)
+
+    def write_recon(self, filename: str, recon: Dict) -> None:
+        """Una fila por chequeo de invoice (total, cantidad) y por fila que no cuadra."""
+        if self.recon_ws is None:
+            self.recon_ws = self.wb.create_sheet("Conciliación")
+            self.recon_ws.append(RECON_COLS)
+        ws = self.recon_ws
+        for inv in recon["invoices"]:
+            for check, key in (("Total Price", "total"), ("Quantity", "quantity")):
+                c = inv[key]
+                ws.append([filename, inv["invoice"], check, c["status"], c["extracted"], c["footer"], c["label"]])
+        for r in recon["rows"]:
+            ws.append([filename, r["invoice"], "Row", "mismatch", r["expected"], r["total"],
+                       f"{r['ref']}: {r['qty']} × {r['unit']}"])
+        if recon["row_mismatches"] > len(recon["rows"]):
+            ws.append([filename, "", "Row", "mismatch", None, None,
+                       f"… {recon['row_mismatches'] - len(recon['rows'])} filas más"])
+        if not recon["invoices"] or recon["pages_unread"]:
+            ws.append([filename, "", "Pages", recon["status"], None, None,
+                       f"{recon['pages_unread']} páginas sin texto (no revisadas)"])
+
+    def save(self) -> str:
+        """Guarda a un archivo temporal y devuelve su ruta."""
+        fd, path = tempfile.mkstemp(suffix=".xlsx")
+        os.close(fd)
+        self.wb.save(path)
+        self.saved = True
+        return path
+
+    def discard(self) -> None:
+        """Cierra sin guardar (sin filas o error) y borra el temporal de openpyxl."""
+        if self.saved:
+            return
+        for ws in (self.ws, self.recon_ws):
+            if ws is None:
+                continue
+            ws.close()
+            writer = getattr(ws, "_writer", None)
+            if writer is not None:
+                writer.cleanup()
+        self.saved = True
+
+class TextRowWriter:
+    """
+    Base de los formatos de texto por líneas: header() y encode(filas) dan
+    el texto tal cual, así el mismo formato sirve para escribir a un
+    temporal o para emitirse directo en la respuesta (stream()).
+    """
+    ext = ""
+    mimetype = "text/plain"
+
+    @staticmethod
+    def header() -> str:
+        return ""
+
+    @staticmethod
+    def encode(rows: List[LineItem]) -> str:
+        raise NotImplementedError
+
+    @staticmethod
+    def error(msg: str) -> str:
+        """Marca de error al final de un stream cuyos headers ya salieron."""
+        return f"# ERROR: {msg}\n"
+
+    @staticmethod
+    def meta(data: dict) -> str:
+        """Registro final con lo que en xlsx va en headers (X-Layouts, X-Reconciliation…)."""
+        return f"# META: {json.dumps(data, ensure_ascii=False)}\n"
+
+    @classmethod
+    def stream(cls, batches: Iterator[List[LineItem]]) -> Iterator[str]:
+        """Texto por lote de filas, a medida que llegan (sin archivo intermedio)."""
+        yield cls.header()
+        for rows in batches:
+            if rows:
+                yield cls.encode(rows)
+
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(suffix="." + self.ext)
+        self.f = os.fdopen(fd, "w", encoding="utf-8", newline="")
+        self.f.write(self.header())
+        self.count = 0
+        self.saved = False
+
+    def write(self, rows: List[LineItem]) -> None:
+        if rows:
+            self.f.write(self.encode(rows))
+        self.count += len(rows)
+
+    def save(self) -> str:
+        self.f.close()
+        self.saved = True
+        return self.path
+
+    def discard(self) -> None:
+        if self.saved:
+            return
+        self.f.close()
+        os.unlink(self.path)
+        self.saved = True
+
+class CsvRowWriter(TextRowWriter):
+    """CSV (UTF-8 con BOM para Excel), cabecera = COLS."""
+    ext = "csv"
+    mimetype = "text/csv"
+
+    @staticmethod
+    def _csv(rows) -> str:
+        buf = StringIO()
+        csv.writer(buf).writerows(rows)
+        return buf.getvalue()
+
+    @staticmethod
+    def header() -> str:
+        return "\ufeff" + CsvRowWriter._csv([COLS])
+
+    @staticmethod
+    def encode(rows: List[LineItem]) -> str:
+        return CsvRowWriter._csv(r.as_row() for r in rows)
+
+    @staticmethod
+    def error(msg: str) -> str:
+        return CsvRowWriter._csv([["#ERROR", msg]])
+
+    @staticmethod
+    def meta(data: dict) -> str:
+        return CsvRowWriter._csv([["#META", json.dumps(data, ensure_ascii=False)]])
+
+class JsonlRowWriter(TextRowWriter):
+    """JSON Lines: un objeto por fila con las claves de COLS."""
+    ext = "jsonl"
+    mimetype = "application/x-ndjson"
+
+    @staticmethod
+    def encode(rows: List[LineItem]) -> str:
+        return "".join(json.dumps(dict(zip(COLS, r.as_row())), ensure_ascii=False) + "\n"
+                       for r in rows)
+
+    @staticmethod
+    def error(msg: str) -> str:
+        return json.dumps({"error": msg}, ensure_ascii=False) + "\n"
+
+    @staticmethod
+    def meta(data: dict) -> str:
+        return json.dumps({"_meta": data}, ensure_ascii=False) + "\n"
+
+# tipos Parquet por columna de COLS (el resto, texto)
+PARQUET_TYPES = {"Quantity": "int64", "Unit Price": "float64", "Total Price": "float64"}
+
+class ParquetRowWriter:
+    """
+    Parquet vía pyarrow (opcional): un row group por cada write(), así solo
+    está en memoria el lote de filas de un archivo.
+    """
+    ext = "parquet"
+    mimetype = "application/vnd.apache.parquet"
+
+    def __init__(self):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("La salida Parquet necesita pyarrow (pip install pyarrow)") from None
+        self.pa = pa
+        self.schema = pa.schema([(c, PARQUET_TYPES.get(c, "string")) for c in COLS])
+        fd, self.path = tempfile.mkstemp(suffix=".parquet")
+        os.close(fd)
+        self.pw = pq.ParquetWriter(self.path, self.schema)
+        self.count = 0
+        self.saved = False
+
+    def write(self, rows: List[LineItem]) -> None:
+        if not rows:
+            return
+        cols = zip(*(r.as_row() for r in rows))
+        self.pw.write_table(self.pa.Table.from_arrays(
+            [self.pa.array(c, type=t) for c, t in zip(cols, self.schema.types)],
+            schema=self.schema))
+        self.count += len(rows)
+
+    def save(self) -> str:
+        self.pw.close()
+        self.saved = True
+        return self.path
+
+    def discard(self) -> None:
+        if self.saved:
+            return
+        self.pw.close()
+        os.unlink(self.path)
+        self.saved = True
+
+# parquet solo se ofrece si pyarrow está instalado (find_spec no lo importa)
+PARQUET_AVAILABLE = find_spec("pyarrow") is not None
+ROW_WRITERS = {w.ext: w for w in (XlsxRowWriter, CsvRowWriter, JsonlRowWriter,
+                                  *((ParquetRowWriter,) if PARQUET_AVAILABLE else ()))}
+
+def stream_file(path: str, chunk: int = 64 * 1024) -> Tuple[Iterator[bytes], int]:
+    """
+    (bloques, tamaño) del archivo. Se abre y se borra del disco enseguida:
+    los bloques salen del handle abierto, así el temporal no queda en /tmp
+    aunque la respuesta nunca se recorra o el cliente corte antes de empezar.
+    """
+    f = open(path, "rb")
+    try:
+        size = os.fstat(f.fileno()).st_size
+    finally:
+        os.unlink(path)
+
+    def chunks() -> Iterator[bytes]:
+        with f:
+            while data := f.read(chunk):
+                yield data
+    return chunks(), size
 
 # ─────────────────────────────  ENDPOINT  ────────────────────────────────────
+def run_profiled(kind: str, fn: Callable[[], Response]) -> Response:
+    """
+    Ejecuta fn con cProfile (.prof) o pyinstrument (.html, si está instalado)
+    y deja el perfil en PROFILE_DIR (podado a PROFILE_MAX_MB); el nombre del
+    archivo, sin la ruta del servidor, vuelve en X-Profile-File.
+    """
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+    if kind == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logging.warning("pyinstrument no instalado; se usa cProfile")
+            kind = "cprofile"
+    if kind == "pyinstrument":
+        prof = Profiler()
+        prof.start()
+        try:
+            resp = fn()
+        finally:
+            prof.stop()
+            path = os.path.join(PROFILE_DIR, f"convert-{stamp}.html")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(prof.output_html())
+    else:
+        import cProfile
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            resp = fn()
+        finally:
+            prof.disable()
+            path = os.path.join(PROFILE_DIR, f"convert-{stamp}.prof")
+            prof.dump_stats(path)
+    logging.info("Perfil guardado en %s", path)
+    evict_oldest(PROFILE_DIR, PROFILE_MAX_MB * 1024 * 1024, (".prof", ".html"))
+    resp.headers["X-Profile-File"] = os.path.basename(path)
+    return resp
+
+def _file_results(jobs, timer: StageTimer, layouts: List[str],
+                  workers: int, page_workers: int) -> Iterator[Tuple[str, FileResult]]:
+    """(nombre, resultado) de cada archivo en orden de subida; registra stats y layout."""
+    for (_, name), res in zip(jobs, run_pipelines(jobs, workers=workers, page_workers=page_workers)):
+        file_timer = StageTimer()
+        file_timer.merge(res.stats)
+        file_timer.log_json("convert_file", file=name, layout=res.layout)
+        timer.merge(res.stats)
+        layouts.append(res.layout)
+        yield name, res
+    timer.count("files", len(jobs))
+
+def _convert(pdfs, workers: int = WORKERS, page_workers: int = PAGE_WORKERS,
+             fmt: str = "xlsx", stream: bool = True) -> Response:
+    """
+    Convierte los uploads al formato `fmt` (ver ROW_WRITERS). Los formatos de
+    texto (csv, jsonl) se emiten en la respuesta a medida que termina cada
+    archivo, salvo con stream=False; xlsx/parquet se arman en un temporal.
+    En streaming se procesan archivos hasta el primero con filas antes de
+    responder: sus errores (p.ej. MemoryCeilingExceeded) salen con su status
+    y sin filas se responde 400, igual que xlsx. Un error posterior cierra
+    el cuerpo con la marca writer_cls.error(); si no, el último registro es
+    writer_cls.meta() con layouts, conciliación y tiempos.
+    """
+    t0 = time.perf_counter()
+    timer = StageTimer()
+    writer_cls = ROW_WRITERS[fmt]
+
+    # se parsea directo del stream del upload: sin archivos temporales
+    jobs=[(pdf.stream, pdf.filename) for pdf in pdfs]
+    layouts=[]   # layout detectado por archivo, en orden de subida
+    filename = f"extracted_data.{writer_cls.ext}"
+
+    if stream and issubclass(writer_cls, TextRowWriter):
+        results = _file_results(jobs, timer, layouts, workers, page_workers)
+        ready = []   # procesados antes de responder, hasta el primero con filas
+        for item in results:
+            ready.append(item)
+            if item[1].rows:
+                break
+        else:
+            return Response("Sin registros extraídos", status=400)
+
+        def body() -> Iterator[str]:
+            # los headers ya salieron: layouts, conciliación y tiempos van en
+            # el registro meta final y un error va en el cuerpo, como en
+            # /api/convert/stream
+            recon = []
+            def batches() -> Iterator[List[LineItem]]:
+                for _, res in chain(ready, results):
+                    recon.append(res.recon["status"] if res.recon else "-")
+                    yield res.rows
+            try:
+                yield from writer_cls.stream(batches())
+            except Exception as exc:
+                logging.exception("Error en /api/convert (archivo %d)", len(layouts) + 1)
+                yield writer_cls.error(f"{type(exc).__name__}: {exc}")
+                return
+            timer.add("total", time.perf_counter() - t0)
+            yield writer_cls.meta({"layouts": layouts, "reconciliation": recon,
+                                   "server_timing": timer.server_timing()})
+            timer.log_json("convert_request", format=fmt, layouts=layouts)
+        return Response(stream_with_context(body()), mimetype=writer_cls.mimetype,
+                        headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+    out=writer_cls()
+    recon=[]   # estado de la conciliación por archivo (X-Reconciliation)
+    write_recon = getattr(out, "write_recon", None)   # solo xlsx tiene hojas
+    # cada archivo se escribe al terminar y sus filas se liberan
+    try:
+        for name, res in _file_results(jobs, timer, layouts, workers, page_workers):
+            with timer.stage("write"):
+                out.write(res.rows)
+                if res.recon and write_recon:
+                    write_recon(name, res.recon)
+            recon.append(res.recon["status"] if res.recon else "-")
+
+        if not out.count:
+            return Response("Sin registros extraídos", status=400)
+
+        with timer.stage("save"):
+            path=out.save()
+    finally:
+        out.discard()   # no-op si ya se guardó
+
+    timer.add("total", time.perf_counter() - t0)
+    timer.log_json("convert_request", format=fmt)
+    body, size = stream_file(path)
+    return Response(
+        body,
+        mimetype=writer_cls.mimetype,
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}",
+            "Content-Length": str(size),
+            "X-Layouts": ",".join(layouts),
+            "X-Reconciliation": ",".join(recon),
+            "Server-Timing": timer.server_timing(),
+        },
+    )
+
 @app.post("/api/convert")
 @app.post("/")
 def convert():
@@ -939,59 +2736,244 @@ def convert():
         pdfs=request.files.getlist("file")
         if not pdfs:
             return "No file(s) uploaded",400
-
-        all_rows=[]
-        for pdf in pdfs:
-            with tempfile.NamedTemporaryFile(delete=False,suffix=".pdf") as tmp:
-                pdf.save(tmp.name)
-
-                # 1) intenta desde el nombre (SIP…), 2) si no, desde el PDF (Invoice No.)
-                inv_num=(m.group(1) if (m:=re.search(r"SIP(\d+)", pdf.filename or "")) else "")
-                if not inv_num:
-                    inv_num = parse_invoice_number_from_pdf(tmp.name)
-
-                logging.info("Procesando %s (inv=%s)", pdf.filename, inv_num)
-
-                # 1-5) extraemos con cada estrategia
-                rows1=extract_original(tmp.name);                         logging.info("r1=%d", len(rows1))
-                rows2=extract_slice(tmp.name,inv_num);                    logging.info("r2=%d", len(rows2))
-                rows3=extract_new_provider(tmp.name,inv_num);             logging.info("r3=%d", len(rows3))
-                rows4=extract_interparfums_blocks(tmp.name,inv_num);      logging.info("r4=%d", len(rows4))
-                rows5=extract_coty(tmp.name, inv_num);                    logging.info("r5=%d", len(rows5))
-                rows6=extract_bulgari_asn(tmp.name, inv_num);             logging.info("r6=%d", len(rows6))
-                rows7 = extract_ipusa_order_conf(tmp.name, inv_num);        logging.info("r7=%d", len(rows7))
-
-                combo = rows1 + rows2 + rows3 + rows4 + rows5 + rows6 + rows7
-                # eliminar duplicados por (Reference, EAN, Invoice)
-                seen=set(); uniq=[]
-                for r in combo:
-                    key=(r["Reference"], r["Code EAN"], r["Invoice Number"])
-                    if key not in seen:
-                        seen.add(key); uniq.append(r)
-
-                # rellenar cualquier HTS / UPC faltante
-                complete_missing_codes(tmp.name, uniq)
-
-                all_rows.extend(uniq)
-            os.unlink(tmp.name)
-
-        if not all_rows:
-            return "Sin registros extraídos",400
-
-        wb=Workbook(); ws=wb.active; ws.append(COLS)
-        for r in all_rows:
-            ws.append([r.get(c, "") for c in COLS])
-        buf=BytesIO(); wb.save(buf); buf.seek(0)
-        return send_file(
-            buf,
-            as_attachment=True,
-            download_name="extracted_data.xlsx",
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+        # format=xlsx (defecto) | csv | jsonl | parquet, por query string o form
+        fmt = (request.values.get("format") or "xlsx").strip().lower()
+        if fmt == ParquetRowWriter.ext and not PARQUET_AVAILABLE:
+            return "La salida Parquet no está disponible en este servidor (falta pyarrow)",501
+        if fmt not in ROW_WRITERS:
+            return f"Formato no soportado: {fmt} (use {', '.join(ROW_WRITERS)})",400
+
+        # X-Profile: perfil de UNA conversión, en este proceso (sin pool ni streaming);
+        # sin CONVERT_PROFILE=1 el header se ignora
+        kind = request.headers.get("X-Profile", "").strip().lower() if PROFILE else ""
+        if kind and kind not in PROFILE_KINDS:
+            return f"X-Profile no soportado: {kind} (use {', '.join(PROFILE_KINDS)})",400
+        if kind:
+            return run_profiled(kind, lambda: _convert(pdfs, workers=1, page_workers=1,
+                                                       fmt=fmt, stream=False))
+        return _convert(pdfs, fmt=fmt)
+    except MemoryCeilingExceeded as exc:
+        logging.error("Error en /convert: %s", exc)
+        return str(exc),413
     except Exception:
         logging.exception("Error en /convert")
         return f"<pre>{traceback.format_exc()}</pre>",500
 
+# ─────────────────────  STREAMING POR ARCHIVO (NDJSON / SSE)  ─────────────────────
+def _event_stream(pdfs, sse: bool, workers: int = WORKERS,
+                  page_workers: int = PAGE_WORKERS) -> Iterator[str]:
+    """
+    Un evento por archivo en cuanto termina su pipeline (filas ya sin
+    duplicados + stats + conciliación), y uno final "done" con los totales. Si un archivo
+    falla se emite "error" y se corta (los anteriores ya llegaron).
+    """
+    def emit(event: str, **data) -> str:
+        payload = json.dumps({"event": event, **data}, ensure_ascii=False, default=str)
+        return f"event: {event}\ndata: {payload}\n\n" if sse else payload + "\n"
+
+    t0 = time.perf_counter()
+    timer = StageTimer()
+    jobs = [(pdf.stream, pdf.filename) for pdf in pdfs]
+    layouts: List[str] = []
+    total = 0
+    try:
+        for i, (name, res) in enumerate(_file_results(jobs, timer, layouts, workers, page_workers)):
+            total += len(res.rows)
+            yield emit("file", index=i, file=name, layout=res.layout,
+                       rows=[r.as_dict() for r in res.rows], stats=res.stats, recon=res.recon)
+    except Exception as exc:
+        logging.exception("Error en /api/convert/stream")
+        yield emit("error", index=len(layouts), error=f"{type(exc).__name__}: {exc}")
+        return
+    timer.add("total", time.perf_counter() - t0)
+    timer.log_json("convert_stream", layouts=layouts)
+    yield emit("done", files=len(jobs), rows=total, stats=timer.to_dict())
+
+@app.post("/api/convert/stream")
+def convert_stream():
+    """
+    Igual que /api/convert pero sin esperar al último archivo: NDJSON por
+    defecto, Server-Sent Events si el cliente manda Accept: text/event-stream.
+    """
+    pdfs=request.files.getlist("file")
+    if not pdfs:
+        return "No file(s) uploaded",400
+    sse = "text/event-stream" in request.headers.get("Accept", "")
+    return Response(stream_with_context(_event_stream(pdfs, sse)),
+                    mimetype="text/event-stream" if sse else "application/x-ndjson",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# ─────────────────────  JOBS ASÍNCRONOS (lotes grandes)  ─────────────────────
+class JobStore:
+    """
+    Estado de los jobs en SQLite (sin servicios externos). Cada llamada abre
+    su propia conexión, así sirve desde los hilos del executor y desde varios
+    procesos del servidor en la misma máquina.
+    """
+
+    def __init__(self, path: str = JOBS_DB):
+        self.path = path
+        self._ready = False   # el esquema se crea en la primera conexión, no al importar
+
+    def _init_schema(self, con: sqlite3.Connection) -> None:
+        con.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY, status TEXT NOT NULL, error TEXT,
+                result TEXT, rows INTEGER NOT NULL DEFAULT 0,
+                created REAL NOT NULL, updated REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS job_files (
+                job_id TEXT NOT NULL, idx INTEGER NOT NULL, name TEXT,
+                status TEXT NOT NULL, rows INTEGER, layout TEXT,
+                PRIMARY KEY (job_id, idx));
+        """)
+
+    @contextmanager
+    def _conn(self) -> Iterator[sqlite3.Connection]:
+        if not self._ready:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with closing(sqlite3.connect(self.path, timeout=30)) as con:
+            con.row_factory = sqlite3.Row
+            if not self._ready:
+                with con:
+                    self._init_schema(con)
+                self._ready = True
+            with con:            # commit / rollback
+                yield con
+
+    def create(self, job_id: str, names: List[str]) -> None:
+        now = time.time()
+        with self._conn() as con:
+            con.execute("INSERT INTO jobs (id, status, created, updated) VALUES (?, 'queued', ?, ?)",
+                        (job_id, now, now))
+            con.executemany("INSERT INTO job_files (job_id, idx, name, status) VALUES (?, ?, ?, 'pending')",
+                            [(job_id, i, n) for i, n in enumerate(names)])
+
+    def set_status(self, job_id: str, status: str, error: str = None, result: str = None) -> None:
+        with self._conn() as con:
+            con.execute("UPDATE jobs SET status=?, error=?, result=?, updated=? WHERE id=?",
+                        (status, error, result, time.time(), job_id))
+
+    def file_status(self, job_id: str, idx: int, status: str,
+                    rows: Optional[int] = None, layout: Optional[str] = None) -> None:
+        with self._conn() as con:
+            con.execute("UPDATE job_files SET status=?, rows=?, layout=? WHERE job_id=? AND idx=?",
+                        (status, rows, layout, job_id, idx))
+            if rows:
+                con.execute("UPDATE jobs SET rows=rows+?, updated=? WHERE id=?",
+                            (rows, time.time(), job_id))
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._conn() as con:
+            job = con.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            files = con.execute("SELECT name, status, rows, layout FROM job_files "
+                                "WHERE job_id=? ORDER BY idx", (job_id,)).fetchall()
+        out = dict(job)
+        out["files"] = [dict(f) for f in files]
+        out["total"] = len(files)
+        out["done"] = sum(f["status"] == "done" for f in files)
+        return out
+
+    def expired(self, ttl_s: float) -> List[str]:
+        with self._conn() as con:
+            return [r["id"] for r in con.execute("SELECT id FROM jobs WHERE updated < ?",
+                                                 (time.time() - ttl_s,))]
+
+    def delete(self, job_id: str) -> None:
+        with self._conn() as con:
+            con.execute("DELETE FROM job_files WHERE job_id=?", (job_id,))
+            con.execute("DELETE FROM jobs WHERE id=?", (job_id,))
+
+job_store = JobStore()
+job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="convert-job")
+
+def _job_dir(job_id: str) -> str:
+    return os.path.join(JOBS_DIR, job_id)
+
+def run_job(job_id: str) -> None:
+    """Corre el pipeline por archivo de un job y deja el XLSX en su carpeta."""
+    job = job_store.get(job_id)
+    jdir = _job_dir(job_id)
+    jobs = [(os.path.join(jdir, f"{i:04d}.pdf"), f["name"]) for i, f in enumerate(job["files"])]
+    job_store.set_status(job_id, "running")
+    out = XlsxRowWriter()
+    # con el pool (CONVERT_WORKERS > 1) los archivos corren a la vez y terminan
+    # en cualquier orden: "running" por archivo solo en modo secuencial; el
+    # progreso es done/total (los resultados llegan en orden de subida)
+    sequential = min(WORKERS, len(jobs)) <= 1
+    try:
+        if jobs and sequential:
+            job_store.file_status(job_id, 0, "running")
+        for i, res in enumerate(run_pipelines(jobs)):
+            out.write(res.rows)
+            if res.recon:
+                out.write_recon(jobs[i][1], res.recon)
+            job_store.file_status(job_id, i, "done", len(res.rows), res.layout)
+            if sequential and i + 1 < len(jobs):
+                job_store.file_status(job_id, i + 1, "running")
+        if not out.count:
+            job_store.set_status(job_id, "failed", error="Sin registros extraídos")
+            return
+        result = os.path.join(jdir, "extracted_data.xlsx")
+        shutil.move(out.save(), result)
+        job_store.set_status(job_id, "done", result=result)
+    except Exception as exc:
+        logging.exception("Error en job %s", job_id)
+        job_store.set_status(job_id, "failed", error=f"{type(exc).__name__}: {exc}")
+    finally:
+        out.discard()
+        for path, _ in jobs:
+            if os.path.exists(path):
+                os.unlink(path)
+
+def purge_jobs(ttl_h: float = JOB_TTL_H) -> None:
+    """Borra jobs (y sus archivos) sin actividad en las últimas ttl_h horas."""
+    for job_id in job_store.expired(ttl_h * 3600):
+        shutil.rmtree(_job_dir(job_id), ignore_errors=True)
+        job_store.delete(job_id)
+
+@app.post("/api/jobs")
+def create_job():
+    try:
+        pdfs=request.files.getlist("file")
+        if not pdfs:
+            return "No file(s) uploaded",400
+
+        purge_jobs()
+        job_id = uuid.uuid4().hex
+        jdir = _job_dir(job_id)
+        os.makedirs(jdir)
+        # el upload se cierra al terminar el request: el job trabaja desde disco
+        for i, pdf in enumerate(pdfs):
+            pdf.save(os.path.join(jdir, f"{i:04d}.pdf"))
+        job_store.create(job_id, [pdf.filename for pdf in pdfs])
+        job_executor.submit(run_job, job_id)
+        return jsonify(id=job_id, status="queued", url=f"/api/jobs/{job_id}"), 202
+    except Exception:
+        logging.exception("Error en /api/jobs")
+        return f"<pre>{traceback.format_exc()}</pre>",500
+
+@app.get("/api/jobs/<job_id>")
+def job_status(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
+        return "Job no encontrado",404
+    job.pop("result", None)
+    if job["status"] == "done":
+        job["download"] = f"/api/jobs/{job_id}/result"
+    return jsonify(job)
+
+@app.get("/api/jobs/<job_id>/result")
+def job_result(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
+        return "Job no encontrado",404
+    if job["status"] != "done":
+        return jsonify(id=job_id, status=job["status"], error=job["error"]), 409
+    return send_file(job["result"], as_attachment=True,
+                     download_name="extracted_data.xlsx", mimetype=XLSX_MIME)
+
 if __name__=="__main__":
     app.run(debug=True,host="0.0.0.0")
 
@@ -0,0 +1,244 @@
+# batch/run.py  ── conversión por lotes de carpetas de PDFs (sin pasar por HTTP)
+"""
+Convierte todos los PDFs de una o varias carpetas / globs con el mismo
+pipeline que /api/convert (process_pdf), en paralelo y sin límite de upload.
+
+    python batch/run.py /srv/facturas --out /srv/salida
+    python batch/run.py "/srv/facturas/**/*.pdf" --out salida --format csv --per-file
+    python batch/run.py entrada/ --out salida --skip hash --workers 4 --summary resumen.json
+
+Los archivos ya convertidos se saltan según el manifiesto de --out
+(.convert-manifest.json): por mtime+tamaño (por defecto) o por sha256
+(--skip hash, también detecta copias renombradas); los que no dieron
+filas no se registran y se reintentan. Salida: un archivo por
+lote (batch-<fecha>.<ext>) o uno por PDF (--per-file). Al final imprime
+filas y conciliación de totales por archivo y el throughput en páginas/s.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "api"))
+
+import convert as C          # noqa: E402
+
+log = logging.getLogger("batch")
+
+MANIFEST = ".convert-manifest.json"
+
+
+def find_pdfs(inputs: List[str], recursive: bool) -> List[str]:
+    """
+    Rutas absolutas de los PDFs de cada carpeta, glob o archivo (sin repetir,
+    ordenadas). Carpetas y globs solo aportan *.pdf; un archivo nombrado
+    explícitamente se toma tal cual.
+    """
+    found = []
+    for item in inputs:
+        if os.path.isdir(item):
+            pat = os.path.join(item, "**", "*") if recursive else os.path.join(item, "*")
+            found += [p for p in glob.glob(pat, recursive=recursive) if p.lower().endswith(".pdf")]
+        elif glob.has_magic(item):
+            found += [p for p in glob.glob(item, recursive=True)
+                      if os.path.isfile(p) and p.lower().endswith(".pdf")]
+        elif os.path.isfile(item):
+            found.append(item)
+        else:
+            log.warning("No existe: %s", item)
+    return sorted({os.path.abspath(p) for p in found})
+
+
+class Manifest:
+    """Registro de lo ya convertido: ruta → mtime, tamaño, sha256, filas, salida."""
+
+    def __init__(self, path: str):
+        self.path = path
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+        self.hashes = {e["sha256"] for e in self.entries.values() if e.get("sha256")}
+
+    def is_done(self, path: str, mode: str) -> Tuple[bool, Optional[str]]:
+        """(ya convertido, sha256 si se calculó)."""
+        if mode == "none":
+            return False, None
+        if mode == "hash":
+            digest = C.source_sha256(path)
+            return digest in self.hashes, digest
+        e = self.entries.get(path)
+        st = os.stat(path)
+        return bool(e) and e["mtime"] == st.st_mtime and e["size"] == st.st_size, None
+
+    def record(self, path: str, digest: Optional[str], rows: int, output: str) -> None:
+        st = os.stat(path)
+        self.entries[path] = {"mtime": st.st_mtime, "size": st.st_size, "sha256": digest,
+                              "rows": rows, "output": output,
+                              "converted": datetime.now().isoformat(timespec="seconds")}
+        if digest:
+            self.hashes.add(digest)
+
+    def save(self) -> None:
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=1, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+
+def _convert_one(path: str, page_workers: int = 1):
+    """Worker: un PDF; los errores vuelven como texto para no cortar el lote."""
+    try:
+        return C.process_pdf(path, os.path.basename(path), page_workers), None
+    except Exception:
+        return None, traceback.format_exc(limit=3)
+
+
+def convert_files(paths: List[str], workers: int, mem_mb: int) -> Iterator[tuple]:
+    """
+    (resultado | None, error | None) por PDF, en el orden de `paths`. Las
+    páginas solo se reparten (C.PAGE_WORKERS) con --workers 1: con el pool
+    de archivos cada worker procesa su PDF entero (los pools no se anidan).
+    """
+    if workers <= 1:
+        yield from (_convert_one(p, C.PAGE_WORKERS) for p in paths)
+        return
+    if len(paths) <= 1:
+        yield from map(_convert_one, paths)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(paths)),
+                             initializer=C._init_worker, initargs=(mem_mb,)) as ex:
+        yield from C.bounded_map(ex, _convert_one, paths, window=2 * workers)
+
+
+def _out_name(out_dir: str, stem: str, ext: str) -> str:
+    path = os.path.join(out_dir, f"{stem}.{ext}")
+    k = 1
+    while os.path.exists(path):
+        path = os.path.join(out_dir, f"{stem}-{k}.{ext}")
+        k += 1
+    return path
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("inputs", nargs="+", help="carpetas, globs o PDFs")
+    ap.add_argument("--out", required=True, help="carpeta de salida (y del manifiesto)")
+    ap.add_argument("--format", default="xlsx", choices=sorted(C.ROW_WRITERS), help="formato de salida")
+    ap.add_argument("--per-file", action="store_true", help="un archivo de salida por PDF")
+    ap.add_argument("--skip", default="mtime", choices=("mtime", "hash", "none"),
+                    help="cómo detectar PDFs ya convertidos")
+    ap.add_argument("--recursive", "-r", action="store_true", help="entrar en subcarpetas")
+    ap.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                    help="procesos en paralelo")
+    ap.add_argument("--worker-mem-mb", type=int, default=C.WORKER_MEM_MB, help="límite de memoria por proceso")
+    ap.add_argument("--summary", default="", help="escribe el resumen en este JSON")
+    args = ap.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)   # silencia el logging por archivo de convert
+    log.setLevel(logging.INFO)
+    os.makedirs(args.out, exist_ok=True)
+    manifest = Manifest(os.path.join(args.out, MANIFEST))
+    writer_cls = C.ROW_WRITERS[args.format]
+
+    todo, digests, skipped = [], {}, 0
+    for path in find_pdfs(args.inputs, args.recursive):
+        done, digest = manifest.is_done(path, args.skip)
+        if done:
+            skipped += 1
+            continue
+        todo.append(path)
+        digests[path] = digest
+    log.info("%d PDFs a convertir, %d ya convertidos", len(todo), skipped)
+
+    t0 = time.perf_counter()
+    files, failed = [], 0
+    batch_out = None if args.per_file else writer_cls()
+    batch_path = _out_name(args.out, datetime.now().strftime("batch-%Y%m%d-%H%M%S"), writer_cls.ext)
+    converted = []   # (pdf, filas) que se registran al guardar el lote
+    try:
+        for path, (res, err) in zip(todo, convert_files(todo, args.workers, args.worker_mem_mb)):
+            name = os.path.basename(path)
+            if err:
+                failed += 1
+                log.error("%s: falló\n%s", name, err)
+                files.append({"file": path, "error": err.strip().splitlines()[-1]})
+                continue
+            counts = res.stats.get("counts", {})
+            entry = {"file": path, "layout": res.layout, "rows": len(res.rows),
+                     "pages": counts.get("pages"), "cached": bool(counts.get("cache_hits")),
+                     "recon": res.recon["status"] if res.recon else None}
+            if args.per_file:
+                out = writer_cls()
+                try:
+                    out.write(res.rows)
+                    if res.recon and hasattr(out, "write_recon"):
+                        out.write_recon(name, res.recon)
+                    target = ""
+                    if out.count:
+                        target = _out_name(args.out, os.path.splitext(name)[0], writer_cls.ext)
+                        shutil.move(out.save(), target)
+                finally:
+                    out.discard()
+                # sin filas no hay salida: no se registra, la próxima corrida lo reintenta
+                if target:
+                    manifest.record(path, digests[path], len(res.rows), target)
+                    manifest.save()   # un corte a mitad de lote no repite lo ya escrito
+                entry["output"] = target
+            else:
+                batch_out.write(res.rows)
+                if res.recon and hasattr(batch_out, "write_recon"):
+                    batch_out.write_recon(name, res.recon)
+                if res.rows:   # sin filas: no va al manifiesto (se reintenta)
+                    converted.append((path, len(res.rows)))
+                entry["output"] = batch_path if res.rows else ""
+            files.append(entry)
+            log.info("%-40s %-18s %5s págs %6d filas  %s", name[:40], res.layout,
+                     entry["pages"] if entry["pages"] is not None else "-", len(res.rows),
+                     entry["recon"] or "-")
+
+        if batch_out is not None:
+            if batch_out.count:
+                shutil.move(batch_out.save(), batch_path)
+            else:
+                batch_path = ""
+            for path, n in converted:
+                manifest.record(path, digests[path], n, batch_path)
+            manifest.save()
+    finally:
+        if batch_out is not None:
+            batch_out.discard()
+
+    elapsed = time.perf_counter() - t0
+    ok = [f for f in files if "error" not in f]
+    pages = sum(f["pages"] or 0 for f in ok)
+    rows = sum(f["rows"] for f in ok)
+    summary = {
+        "files": len(ok), "failed": failed, "skipped": skipped,
+        "pages": pages, "rows": rows, "seconds": round(elapsed, 3),
+        "pages_per_s": round(pages / elapsed, 2) if elapsed else None,
+        "rows_per_file": round(rows / len(ok), 1) if ok else 0,
+        "recon_mismatch": sum(f["recon"] == "mismatch" for f in ok),
+        "output": None if args.per_file else batch_path or None,
+        "per_file": files,
+    }
+    log.info("%d archivos (%d fallidos, %d saltados), %d págs, %d filas en %.1fs → %.1f págs/s",
+             len(ok), failed, skipped, pages, rows, elapsed, summary["pages_per_s"] or 0)
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=1, ensure_ascii=False)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+# bench/importtime.py  ── arranque en frío de api/convert.py
+"""
+Mide `import convert` en un intérprete nuevo (lo que paga cada cold start
+en Vercel) con python -X importtime, y qué módulos se llevan el tiempo.
+
+    python bench/importtime.py
+    python bench/importtime.py --repeat 10 --out importtime.json
+    python bench/importtime.py --compare importtime.json
+
+Cada corrida es un proceso nuevo; se toma la corrida más rápida de
+--repeat. Además se mide, en el mismo proceso, lo que se difiere al primer
+uso (LAZY: pdfplumber, openpyxl, numpy, pool de procesos). --compare sale
+con código 1 si el import se volvió más lento o si algún módulo diferido
+vuelve a cargarse al importar convert.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+API = os.path.join(HERE, "..", "api")
+
+# módulos que convert importa al primer uso, no al arrancar
+LAZY = ("pdfplumber", "openpyxl", "numpy", "concurrent.futures.process")
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int, int]]:
+    """(módulo, nivel, self µs, acumulado µs) por línea de -X importtime, en orden."""
+    out = []
+    for ln in stderr.splitlines():
+        if not ln.startswith("import time:") or "imported package" in ln:
+            continue
+        self_us, cum_us, name = ln.split(":", 1)[1].split("|", 2)
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        out.append((name.strip(), level, int(self_us), int(cum_us)))
+    return out
+
+
+def measure_once(lazy: Tuple[str, ...]) -> Dict:
+    """Un proceso nuevo: import convert y luego los módulos diferidos."""
+    code = "import convert\n" + "".join(f"import {m}\n" for m in lazy)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [API, os.environ.get("PYTHONPATH")])))
+    env.setdefault("CONVERT_CACHE_MAX_MB", "0")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          env=env, capture_output=True, text=True)
+    if proc.returncode:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    entries = parse_importtime(proc.stderr)
+    top = next(i for i, e in enumerate(entries) if e[0] == "convert" and e[1] == 0)
+    children = [e for e in entries[:top] if e[1] == 1]
+    # lo que cuelga de convert va antes de su línea (importtime imprime al terminar)
+    eager = {e[0] for e in entries[:top]}
+    deferred = {e[0]: e[3] for e in entries[top + 1:] if e[1] == 0 and e[0] in lazy}
+    return {
+        "convert_us": entries[top][3],
+        "convert_self_us": entries[top][2],
+        "modules": {name: cum for name, _, _, cum in children},
+        "eager_lazy": sorted(m for m in lazy if m in eager),
+        "deferred_us": deferred,
+    }
+
+
+def compare(old_path: str, new: Dict, tolerance: float) -> int:
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)["result"]
+    ratio = new["convert_us"] / old["convert_us"] if old["convert_us"] else float("inf")
+    bad = 0
+    flag = ""
+    if ratio > tolerance:
+        flag, bad = "MÁS LENTO", bad + 1
+    print(f"{'import convert':28} {old['convert_us'] / 1000:9.1f} {new['convert_us'] / 1000:9.1f} "
+          f"{ratio:6.2f} {flag}")
+    for m in new["eager_lazy"]:
+        if m not in old["eager_lazy"]:
+            bad += 1
+            print(f"{m:28} {'diferido':>9} {'en frío':>9}        CARGA AL IMPORTAR")
+    return 1 if bad else 0
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--repeat", type=int, default=5, help="procesos a medir (se toma el más rápido)")
+    ap.add_argument("--top", type=int, default=12, help="módulos a listar por tiempo acumulado")
+    ap.add_argument("--out", default="", help="escribe el resultado en este JSON")
+    ap.add_argument("--compare", default="", help="JSON previo contra el que comparar")
+    ap.add_argument("--tolerance", type=float, default=1.2, help="ratio máximo antes de marcar regresión")
+    args = ap.parse_args(argv)
+
+    # módulos diferidos que no están instalados no se pueden medir
+    lazy = tuple(m for m in LAZY if _importable(m))
+    runs = [measure_once(lazy) for _ in range(max(1, args.repeat))]
+    best = min(runs, key=lambda r: r["convert_us"])
+
+    print(f"import convert: {best['convert_us'] / 1000:.1f} ms "
+          f"(propio {best['convert_self_us'] / 1000:.1f} ms, mejor de {len(runs)})")
+    for name, us in sorted(best["modules"].items(), key=lambda kv: -kv[1])[:args.top]:
+        print(f"  {name:34} {us / 1000:8.1f} ms")
+    if best["deferred_us"]:
+        print("diferido al primer uso:")
+        for name, us in best["deferred_us"].items():
+            print(f"  {name:34} {us / 1000:8.1f} ms")
+    for m in best["eager_lazy"]:
+        print(f"AVISO: {m} se carga al importar convert")
+
+    report = {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": len(runs),
+        },
+        "result": best,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+    return compare(args.compare, best, args.tolerance) if args.compare else 0
+
+
+def _importable(name: str) -> bool:
+    from importlib.util import find_spec
+    try:
+        return find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+if __name__ == "__main__":
+    sys.exit(main())
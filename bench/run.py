@@ -0,0 +1,256 @@
+# bench/run.py  ── benchmark de extractores sobre facturas sintéticas
+"""
+Mide cada extract_*, complete_missing_codes y el request completo a
+/api/convert (Flask test client) sobre PDFs sintéticos de cada layout.
+
+    python bench/run.py --sizes 1,10,100 --out bench.json
+    python bench/run.py --sizes 1,10,100 --compare bench.json
+
+Cada medición abre el PDF de cero (incluye el análisis de layout) y toma
+el mínimo de --repeat corridas. Además del tiempo se guarda un sha256 de
+las filas: --compare avisa si algo se volvió más lento *o* cambió de
+resultado, y sale con código 1.
+
+El target process_pdf corre el pipeline completo y guarda el estado de la
+conciliación contra el pie: los PDFs sintéticos traen el total
+correcto, así que cualquier estado distinto de "ok" también sale con 1.
+El target low_memory repite process_pdf con CONVERT_LOW_MEMORY=0 y =1:
+sale con 1 si las filas difieren o si baja memoria es más lenta que
+--lowmem-tolerance (soltar una página no debe obligar a re-analizarla).
+El target coord_rows_numpy compara rows_from_page (NumPy) con la versión
+de referencia _rows_from_page_py página a página (filas y líneas de pie);
+si difieren también sale con 1. El target page_shard corre process_pdf
+con páginas repartidas en 2 procesos (sin mínimo de páginas) y compara
+filas y conciliación con la corrida secuencial.
+"""
+import argparse
+import gc
+import hashlib
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+from io import BytesIO
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [HERE, os.path.join(HERE, "..", "api")]
+os.environ.setdefault("CONVERT_CACHE_MAX_MB", "0")     # sin caché: medimos extracción real
+
+import convert as C          # noqa: E402
+import synth                 # noqa: E402
+
+log = logging.getLogger("bench")
+
+LOWMEM_PAIRS = 7      # mínimo de pares normal/baja memoria por layout
+
+EXTRACTORS = {
+    "extract_original":            lambda doc, inv: C.extract_original(doc),
+    "extract_slice":               C.extract_slice,
+    "extract_new_provider":        C.extract_new_provider,
+    "extract_interparfums_blocks": C.extract_interparfums_blocks,
+    "extract_coty":                C.extract_coty,
+    "extract_bulgari_asn":         C.extract_bulgari_asn,
+    "extract_ipusa_order_conf":    C.extract_ipusa_order_conf,
+}
+
+
+def rows_digest(rows) -> str:
+    rows = [r.as_dict() for r in rows]
+    return hashlib.sha256(json.dumps(rows, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def timed(fn, repeat: int):
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def bench_layout(layout: str, pages: int, repeat: int, targets) -> list:
+    data = synth.make_pdf(layout, pages)
+    inv = "BENCH"
+    results = []
+
+    def record(target, seconds, rows, recon=None, **extra):
+        n = None if rows is None else len(rows)
+        results.append({"layout": layout, "pages": pages, "target": target,
+                        "seconds": round(seconds, 6), "rows": n,
+                        "rows_sha": None if rows is None else rows_digest(rows), **extra})
+        if recon is not None:
+            results[-1]["recon"] = recon
+        log.info("%-14s %4dp %-28s %8.3fs %6s filas%s", layout, pages, target, seconds,
+                 "-" if n is None else n, f"  pie: {recon}" if recon else "")
+
+    for name, fn in EXTRACTORS.items():
+        if targets and name not in targets:
+            continue
+        sec, rows = timed(lambda: fn(data, inv), repeat)
+        record(name, sec, rows)
+
+    if not targets or "complete_missing_codes" in targets:
+        base = C.EXTRACTORS[layout](data, inv)
+
+        def fill():
+            rows = [C.LineItem(r.ref, "", "", *r.as_row()[3:], r.order_nr) for r in base]
+            C.complete_missing_codes(data, rows)
+            return rows
+        sec, rows = timed(fill, repeat)
+        record("complete_missing_codes", sec, rows)
+
+    if not targets or "process_pdf" in targets:
+        sec, res = timed(lambda: C.process_pdf(data, f"{layout}.pdf"), repeat)
+        record("process_pdf", sec, res.rows, (res.recon or {}).get("status"))
+
+    if not targets or "low_memory" in targets:
+        # modos en pares (orden alterno) con el heap recogido antes de cada
+        # corrida; el ratio compara la mejor corrida de cada modo, como
+        # timeit: el ruido de la máquina solo suma tiempo. Con --repeat bajo se
+        # corren igual al menos LOWMEM_PAIRS pares, porque en documentos de
+        # una página cada corrida dura pocos ms
+        pairs, digests = [], {}
+        saved = C.LOW_MEMORY
+        try:
+            for k in range(max(repeat, LOWMEM_PAIRS)):
+                pair = {}
+                for mode in (("0", "1"), ("1", "0"))[k % 2]:
+                    C.LOW_MEMORY = mode
+                    gc.collect()
+                    pair[mode], res = timed(lambda: C.process_pdf(data, f"{layout}.pdf", 1), 1)
+                    digests[mode] = rows_digest(res.rows)
+                pairs.append(pair)
+        finally:
+            C.LOW_MEMORY = saved
+        best = {m: min(p[m] for p in pairs) for m in ("0", "1")}
+        record("low_memory", best["1"], res.rows,
+               ratio=round(best["1"] / best["0"], 3),
+               same_rows=digests["0"] == digests["1"])
+
+    if (not targets or "coord_rows_numpy" in targets) and C._numpy() is not None:
+        with C.ParsedPDF(data) as doc:
+            bounds = doc.col_bounds()
+            for p in doc.pages:
+                p.chars   # el análisis de layout queda fuera de la medición
+
+            def both(fn):
+                out = []
+                for p in doc.pages:
+                    footer = []
+                    out.append((fn(p, bounds, footer), footer))
+                return out
+            sec, fast = timed(lambda: both(C.rows_from_page), repeat)
+            ref = both(C._rows_from_page_py)
+        record("coord_rows_numpy", sec, None, same_rows=fast == ref)
+
+    if not targets or "page_shard" in targets:
+        seq = C.process_pdf(data, f"{layout}.pdf", 1)
+        saved = C.PAGE_SHARD_MIN_PAGES
+        C.PAGE_SHARD_MIN_PAGES = 1
+        try:
+            sec, res = timed(lambda: C.process_pdf(data, f"{layout}.pdf", 2), repeat)
+        finally:
+            C.PAGE_SHARD_MIN_PAGES = saved
+        record("page_shard", sec, res.rows, sharded="prefetch" in res.stats["stages"],
+               same_rows=rows_digest(seq.rows) == rows_digest(res.rows) and seq.recon == res.recon)
+
+    if not targets or "api_convert" in targets:
+        client = C.app.test_client()
+
+        def post():
+            resp = client.post("/api/convert", data={"file": (BytesIO(data), f"{layout}.pdf")},
+                               content_type="multipart/form-data")
+            body = resp.get_data()
+            if resp.status_code != 200:
+                raise RuntimeError(f"/api/convert {resp.status_code}: {body[:200]!r}")
+            return body
+        sec, _ = timed(post, repeat)
+        # el xlsx no es determinista byte a byte (fechas del zip): solo tiempo
+        record("api_convert", sec, None)
+
+    return results
+
+
+def compare(old_path: str, new: list, tolerance: float) -> int:
+    with open(old_path, encoding="utf-8") as f:
+        old = {(r["layout"], r["pages"], r["target"]): r for r in json.load(f)["results"]}
+    bad = 0
+    print(f"{'layout':14} {'pages':>5} {'target':28} {'old':>9} {'new':>9} {'ratio':>6}")
+    for r in new:
+        o = old.get((r["layout"], r["pages"], r["target"]))
+        if not o:
+            continue
+        ratio = r["seconds"] / o["seconds"] if o["seconds"] else float("inf")
+        flag = ""
+        if o["rows_sha"] != r["rows_sha"]:
+            flag, bad = "CAMBIÓ RESULTADO", bad + 1
+        elif ratio > tolerance:
+            flag, bad = "MÁS LENTO", bad + 1
+        print(f"{r['layout']:14} {r['pages']:5d} {r['target']:28} "
+              f"{o['seconds']:9.3f} {r['seconds']:9.3f} {ratio:6.2f} {flag}")
+    return 1 if bad else 0
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", default="1,10,50", help="páginas por PDF, separadas por coma (1…500)")
+    ap.add_argument("--layouts", default=",".join(synth.LAYOUTS), help="layouts a generar")
+    ap.add_argument("--targets", default="", help="limitar a estas funciones (coma); vacío = todas")
+    ap.add_argument("--repeat", type=int, default=3, help="corridas por medición (se toma el mínimo)")
+    ap.add_argument("--out", default="", help="escribe los resultados en este JSON")
+    ap.add_argument("--compare", default="", help="JSON previo contra el que comparar")
+    ap.add_argument("--tolerance", type=float, default=1.2, help="ratio máximo antes de marcar regresión")
+    ap.add_argument("--lowmem-tolerance", type=float, default=1.2,
+                    help="ratio máximo baja memoria / normal en el target low_memory")
+    args = ap.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)   # silencia el logging del endpoint
+    log.setLevel(logging.INFO)
+    targets = {t for t in args.targets.split(",") if t}
+    results = []
+    for layout in args.layouts.split(","):
+        for pages in (int(s) for s in args.sizes.split(",")):
+            results.extend(bench_layout(layout, pages, args.repeat, targets))
+
+    report = {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": getattr(C._numpy(), "__version__", None),
+            "extractor_version": C.EXTRACTOR_VERSION,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    # el pie sintético es correcto: todo lo que no concilie es un error
+    unreconciled = [r for r in results if r.get("recon", "ok") != "ok"]
+    for r in unreconciled:
+        print(f"PIE NO CONCILIA: {r['layout']} {r['pages']}p → {r['recon']}", file=sys.stderr)
+    lowmem_bad = [r for r in results if r["target"] == "low_memory"
+                  and (not r["same_rows"] or r["ratio"] > args.lowmem_tolerance)]
+    for r in lowmem_bad:
+        print(f"BAJA MEMORIA: {r['layout']} {r['pages']}p → ×{r['ratio']}"
+              f"{'' if r['same_rows'] else ', filas distintas'}", file=sys.stderr)
+    differ = [r for r in results if r["target"] != "low_memory" and r.get("same_rows") is False]
+    for r in differ:
+        print(f"FILAS DISTINTAS: {r['layout']} {r['pages']}p {r['target']}", file=sys.stderr)
+    # sin reparto la comparación de page_shard no prueba nada
+    unsharded = [r for r in results if r.get("sharded") is False]
+    for r in unsharded:
+        print(f"SIN REPARTO: {r['layout']} {r['pages']}p page_shard no usó prefetch", file=sys.stderr)
+    rc = compare(args.compare, results, args.tolerance) if args.compare else 0
+    return 1 if unreconciled or lowmem_bad or differ or unsharded else rc
+
+
+if __name__ == "__main__":
+    sys.exit(main())
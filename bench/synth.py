@@ -0,0 +1,191 @@
+# bench/synth.py  ── PDFs sintéticos por layout de proveedor (sin dependencias)
+"""
+Genera facturas sintéticas para cada uno de los 7 layouts que soporta
+api/convert.py. Escribe el PDF a mano (Helvetica, WinAnsi) para no
+depender de reportlab/fpdf.
+"""
+import random
+from typing import Callable, Dict, List, Tuple
+
+Item  = Tuple[float, float, str]      # (x, y, texto)
+Pages = List[List[Item]]
+
+
+def _esc(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(pages: Pages, size=(792, 612), font_size: int = 7) -> bytes:
+    """PDF mínimo: una página por lista de (x, y, texto)."""
+    objs: List[bytes] = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"",   # /Pages, se completa al final
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    kids = []
+    for items in pages:
+        body = "\n".join(f"BT /F1 {font_size} Tf {x} {y} Td ({_esc(t)}) Tj ET" for x, y, t in items)
+        stream = body.encode("latin-1")
+        objs.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objs.append((
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /CropBox [0 0 %d %d] "
+            "/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (*size, *size, len(objs))
+        ).encode())
+        kids.append(len(objs))
+    objs[1] = ("<< /Type /Pages /Kids [%s] /Count %d >>"
+               % (" ".join(f"{k} 0 R" for k in kids), len(kids))).encode()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs) + 1)
+    for off in offsets:
+        out += b"%010d 00000 n \n" % off
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objs) + 1, xref)
+    return bytes(out)
+
+
+# ─────────────────────  helpers  ─────────────────────
+def _ean(rng: random.Random) -> str:
+    return "33" + "".join(str(rng.randrange(10)) for _ in range(11))
+
+def _qty_price(rng: random.Random) -> Tuple[int, float]:
+    return rng.randrange(1, 50), rng.randrange(100, 9000) / 100
+
+def _eu(v: float) -> str:
+    return f"{v:.2f}".replace(".", ",")
+
+def _money(q: int, u: float) -> float:
+    """Total de línea tal como se imprime (2 decimales): la suma del pie cuadra."""
+    return round(q * u, 2)
+
+def _text_pages(header: List[str], item_fn, n_pages: int, per_page: int,
+                footer_fn: Callable[[float], List[str]], rng: random.Random) -> Pages:
+    """
+    Layouts de texto: cabecera + N ítems por página, una línea cada 10 pt.
+    item_fn(k, rng) → (líneas, total); el pie de la última página lleva la
+    suma real (footer_fn(suma)), así reconcile da "ok".
+    """
+    pages, k, total = [], 0, 0.0
+    for p in range(n_pages):
+        lines = list(header)
+        for _ in range(per_page):
+            item_lines, item_total = item_fn(k, rng)
+            lines.extend(item_lines)
+            total += item_total
+            k += 1
+        if p == n_pages - 1:
+            lines.extend(footer_fn(total))
+        pages.append([(30, 580 - 10 * i, ln) for i, ln in enumerate(lines)])
+    return pages
+
+
+# ─────────────────────  layouts  ─────────────────────
+def original(n_pages: int, rng: random.Random) -> Pages:
+    """Extractor 1: factura clásica Dior (ROW_FACT + descripción debajo)."""
+    def item(k, rng):
+        q, u = _qty_price(rng)
+        return [f"F{k:06d}A {_ean(rng)} 33030010 {q} {_eu(u)} {_eu(q * u)}",
+                f"EAU DE PARFUM {k} 100ML"], _money(q, u)
+    return _text_pages(["FACTURE N° 90012345", "PAYS D'ORIGINE : FRANCE",
+                        "Reference EAN Douane Qte PU Total"],
+                       item, n_pages, 20, lambda t: [f"TOTAL {_eu(t)}"], rng)
+
+def lvmh(n_pages: int, rng: random.Random) -> Pages:
+    """Extractor 2: columnas por coordenadas (COL_BOUNDS), con descripción extendida."""
+    pages, k, total = [], 0, 0.0
+    for p in range(n_pages):
+        items: List[Item] = [(10, 590, "Invoice 7000123"), (10, 578, "Your Order Nr: PO-55512"),
+                             (10, 566, "No. Description UPC Ctry HS Qty Unit Total")]
+        y = 550
+        for _ in range(20):
+            q, u = _qty_price(rng)
+            items += [(10, y, f"{10000 + k}A"), (80, y, f"LIP ROUGE SHADE {k}"), (350, y, _ean(rng)),
+                      (440, y, "FR"), (470, y, "33041000"), (540, y, str(q)),
+                      (590, y, f"{u:.2f}"), (640, y, f"{q * u:.2f}")]
+            total += _money(q, u)
+            y -= 12
+            if k % 3 == 0:
+                items.append((80, y, "LONG WEAR EDITION"))
+                y -= 12
+            k += 1
+        if p == n_pages - 1:
+            items.append((10, y - 10, f"Total before tax {total:.2f}"))
+        pages.append(items)
+    return pages
+
+def new_provider(n_pages: int, rng: random.Random) -> Pages:
+    """Extractor 3: línea completa / sin HS / descripción en línea previa."""
+    def item(k, rng):
+        q, u = _qty_price(rng)
+        tail = f"{q} Each {u:.2f} - {q * u:,.2f}"
+        if k % 4 == 3:
+            return [f"SERUM DE NUIT {k}", f"{20000 + k}B {_ean(rng)} US 3304.99.5000 {tail}"], _money(q, u)
+        if k % 4 == 2:
+            return [f"{20000 + k}B NIGHT CREAM {k} {_ean(rng)} US {tail}"], _money(q, u)
+        return [f"{20000 + k}B NIGHT CREAM {k} {_ean(rng)} US 3304.99.5000 {tail}"], _money(q, u)
+    return _text_pages(["Invoice 123456", "No. Description UPC Ctry HS Qty UOM Unit POSM Total"],
+                       item, n_pages, 20, lambda t: [f"Total USD {t:,.2f}"], rng)
+
+def interparfums(n_pages: int, rng: random.Random) -> Pages:
+    """Extractor 4: Interparfums Italia, totales inline + HS/EAN debajo."""
+    def item(k, rng):
+        q, u = _qty_price(rng)
+        return [f"IPX{k:05d} ROSE EDP 100ML {q} PZ {_eu(u)} {_eu(q * u)} {_eu(q * u)} NI",
+                "HS Code: 33030010, Origin: IT", f"EAN Code: {_ean(rng)}"], _money(q, u)
+    return _text_pages(["INVOICE No. IT-2024-0099", "Code Description Qty UM Price Amount VAT"],
+                       item, n_pages, 12, lambda t: [f"Total EUR {_eu(t)}"], rng)
+
+def coty(n_pages: int, rng: random.Random) -> Pages:
+    """Extractor 5: COTY, ítems en una o dos líneas + HS/origen."""
+    def item(k, rng):
+        q, u = _qty_price(rng)
+        if k % 2:
+            return [f"{30000000 + k} {_ean(rng)} CALVIN EDT {k}", f"{q} {_eu(u)} {_eu(q * u)}",
+                    "(HS No. 33030010)", "Country of origin: France"], _money(q, u)
+        # la descripción no termina en número: "EDT 2 25 31,17" es ambiguo (unidad con miles)
+        return [f"{30000000 + k} {_ean(rng)} CALVIN EDT {k} 50ML {q} {_eu(u)} {_eu(q * u)}",
+                "(HS No. 33030010)", "Country of origin: France"], _money(q, u)
+    return _text_pages(["COTY INVOICE 5550001", "Ref. No. / EAN Code Article Qty Price USD"],
+                       item, n_pages, 12, lambda t: [f"Subtotal {_eu(t)}"], rng)
+
+def bulgari_asn(n_pages: int, rng: random.Random) -> Pages:
+    """Extractor 6: Bulgari ASN, bloques numérica / descripción / Origin."""
+    def item(k, rng):
+        q, u = _qty_price(rng)
+        return [f"{k + 1} {41000 + k} {q} PCE 33030010 1,20 KG {_eu(u)} {_eu(q * u)}",
+                f"BVLGARI OMNIA {k} EDT", "Origin: Italy"], _money(q, u)
+    return _text_pages(["ADVANCED SHIPPING NOTICE 8000777",
+                        "Pos. Reference - Cust. Material Q.ty UM HS Net W Price Total"],
+                       item, n_pages, 12, lambda t: [f"TOTAL: {_eu(t)}"], rng)
+
+def ipusa(n_pages: int, rng: random.Random) -> Pages:
+    """Extractor 7: Interparfums USA, una o dos líneas + UPC."""
+    def item(k, rng):
+        q, u = rng.randrange(1, 900), rng.randrange(100, 9000) / 100
+        nums = f"IT 3303.00.0000 {q} {q} Each {u:.2f} - {q * u:,.2f}"
+        if k % 2:
+            return [f"JC{k:05d} JIMMY CHOO EDP", "SPRAY 100ML", nums, f"UPC: 0857{k:08d}"], _money(q, u)
+        return [f"JC{k:05d} JIMMY CHOO EDP {nums}", f"UPC: 0857{k:08d}"], _money(q, u)
+    return _text_pages(["Order Confirmation SO-123456",
+                        "No. Description Ctry HS Qty Res UOM Unit POSM Total"],
+                       item, n_pages, 12, lambda t: [f"Grand Total {t:,.2f}"], rng)
+
+
+LAYOUTS: Dict[str, Callable[[int, random.Random], Pages]] = {
+    "original":     original,
+    "lvmh":         lvmh,
+    "new_provider": new_provider,
+    "interparfums": interparfums,
+    "coty":         coty,
+    "bulgari_asn":  bulgari_asn,
+    "ipusa":        ipusa,
+}
+
+
+def make_pdf(layout: str, n_pages: int, seed: int = 0) -> bytes:
+    """PDF sintético determinista (misma semilla → mismos bytes)."""
+    return write_pdf(LAYOUTS[layout](n_pages, random.Random(seed)))